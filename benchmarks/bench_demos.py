@@ -0,0 +1,197 @@
+'''
+Runs the main loop of every Python demo on synthetic videos against the fake
+inference engine of demoTools/fakeie.py and reports, as JSON, the throughput,
+the latency percentiles of every stage and the peak memory of each demo.
+
+    python benchmarks/bench_demos.py --frames 300 --latency 0.02 --parallel 2
+
+Each demo runs in its own subprocess (this script with --run) from the demo
+directory, like the job scripts do. Stage latencies are collected in-process
+by wrapping the demo functions that make up each stage:
+
+    ssd            the pipeline stages (decode, preprocess, infer, write, render)
+    store_traffic  decode (VideoCap.read), infer (InferRequestPool.submit),
+                   count, annotate and stats
+    flawdetector   orientation, color and crack checks, once per object
+
+The OpenCV wheels from PyPI cannot encode H.264, so when a demo opens a video
+writer with a codec the local OpenCV does not support, the benchmark falls
+back to mp4v instead of failing.
+'''
+
+import argparse
+import json
+import os
+import importlib
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.insert(0, ROOT)
+DEMO_DIRS = {'ssd': os.path.join(ROOT, 'python', 'object-detection-python'),
+             'store_traffic': os.path.join(ROOT, 'python', 'store-traffic-monitor-python'),
+             'flawdetector': os.path.join(ROOT, 'python', 'flaw-detector-python')}
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    '''Collects the latency of every call of the wrapped functions, by stage name'''
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, name, latency):
+        self.samples.setdefault(name, []).append(latency)
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - start)
+        return timed
+
+    def report(self):
+        import numpy as np
+        stages = {}
+        for name, samples in self.samples.items():
+            ms = np.asarray(samples) * 1000
+            stages[name] = {'calls': len(ms), 'mean_ms': round(float(ms.mean()), 3)}
+            for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+                stages[name]['p{}_ms'.format(p)] = round(float(value), 3)
+        return stages
+
+
+def _fallback_video_writer(cv2):
+    writer = cv2.VideoWriter
+
+    def open_writer(path, fourcc, fps, size, is_color=True):
+        vw = writer(path, fourcc, fps, size, is_color)
+        if not vw.isOpened():
+            vw = writer(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size, is_color)
+        return vw
+    cv2.VideoWriter = open_writer
+
+
+def _run_ssd(args, timer):
+    from demoTools import pipeline
+    record = pipeline.StageStats.record
+
+    def timed_record(self, latency, depth):
+        timer.add(self.name, latency)
+        record(self, latency, depth)
+    pipeline.StageStats.record = timed_record
+    sys.argv = ['object_detection_demo_ssd_async.py', '-m', 'bench.xml', '-i', args.video, '-o', args.output_dir,
+                '-nr', args.num_requests, '-r', args.render]
+    demo = importlib.import_module('object_detection_demo_ssd_async')
+    demo.main()
+    return args.frames
+
+
+def _run_store_traffic(args, timer):
+    sys.argv = ['store_traffic_monitor.py', '-m', 'bench.xml', '-l', 'labels.txt', '-c', args.config,
+                '-n', str(args.streams), '-o', args.output_dir, '-d', 'CPU', '-nr', args.num_requests]
+    demo = importlib.import_module('store_traffic_monitor')
+    demo.VideoCap.read = timer.wrap('decode', demo.VideoCap.read)
+    demo.InferRequestPool.submit = timer.wrap('infer', demo.InferRequestPool.submit)
+    demo.RenderWorker._write_stats = timer.wrap('stats', demo.RenderWorker._write_stats)
+    for stage, fn in (('count', 'count_objects'), ('annotate', 'annotate_frame')):
+        setattr(demo, fn, timer.wrap(stage, getattr(demo, fn)))
+    demo.main()
+    return args.frames * args.streams
+
+
+def _run_flawdetector(args, timer):
+    demo = importlib.import_module('flawdetector')
+    # Every check runs once per object
+    for stage, fn in (('orientation', 'detect_orientation'), ('color', 'detect_color'), ('crack', 'detect_crack')):
+        setattr(demo, fn, timer.wrap(stage, getattr(demo, fn)))
+    demo.runFlawDetector(args.video, args.output_dir)
+    return args.frames
+
+
+RUNNERS = {'ssd': _run_ssd, 'store_traffic': _run_store_traffic, 'flawdetector': _run_flawdetector}
+
+
+def run_demo(args):
+    '''Body of the --run subprocess: runs one demo in-process and prints its metrics as JSON'''
+    import cv2
+    sys.path.insert(0, os.getcwd())
+    _fallback_video_writer(cv2)
+    timer = StageTimer()
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        start = time.perf_counter()
+        frames = RUNNERS[args.run](args, timer)
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    print(json.dumps({'frames': frames,
+                      'seconds': round(elapsed, 3),
+                      'fps': round(frames / elapsed, 2),
+                      'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                      'stages': timer.report()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--demos', default='ssd,store_traffic,flawdetector', help="Comma separated demos to run")
+    parser.add_argument('--frames', default=300, type=int, help="Frames in every synthetic video")
+    parser.add_argument('--width', default=1280, type=int)
+    parser.add_argument('--height', default=720, type=int)
+    parser.add_argument('--objects', default=8, type=int, help="Moving objects in every synthetic video")
+    parser.add_argument('--streams', default=3, type=int, help="Video streams of the store traffic monitor")
+    parser.add_argument('--latency', default=0.01, type=float, help="Seconds a fake inference request takes")
+    parser.add_argument('--parallel', default=1, type=int, help="Requests the fake device runs concurrently")
+    parser.add_argument('--num_requests', default='auto', help="Infer requests of the demos, or 'auto'")
+    parser.add_argument('--render', default='none', choices=['none', 'inline'], help="Rendering of the SSD demo")
+    parser.add_argument('--workdir', default=None, help="Directory for the synthetic inputs and the demo outputs")
+    parser.add_argument('--run', default=None, choices=sorted(RUNNERS), help=argparse.SUPPRESS)
+    parser.add_argument('--video', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--config', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--output_dir', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run_demo(args)
+
+    from synthetic import make_video
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_demos_')
+    os.makedirs(workdir, exist_ok=True)
+    videos = []
+    for i in range(args.streams):
+        videos.append(os.path.join(workdir, 'input_{}.mp4'.format(i)))
+        make_video(videos[-1], args.frames, (args.width, args.height), objects=args.objects, seed=i)
+    config = os.path.join(workdir, 'conf.txt')
+    with open(config, 'w') as f:
+        for video, label in zip(videos, ['person', 'car', 'bottle'] * args.streams):
+            f.write('{} {}\n'.format(os.path.abspath(video), label))
+
+    env = dict(os.environ, IE_BACKEND='fake', PBS_JOBID='bench', LOOP='false',
+               FAKE_IE_LATENCY=str(args.latency), FAKE_IE_PARALLEL=str(args.parallel))
+    report = {'frames': args.frames,
+              'resolution': [args.width, args.height],
+              'latency_s': args.latency,
+              'parallel': args.parallel,
+              'workdir': workdir,
+              'demos': {}}
+    for demo in args.demos.split(','):
+        output_dir = os.path.join(workdir, demo)
+        os.makedirs(output_dir, exist_ok=True)
+        cmd = [sys.executable, os.path.abspath(__file__), '--run', demo, '--frames', str(args.frames),
+               '--streams', str(args.streams), '--num_requests', args.num_requests, '--render', args.render,
+               '--video', os.path.abspath(videos[0]), '--config', config, '--output_dir', os.path.abspath(output_dir)]
+        out = subprocess.run(cmd, cwd=DEMO_DIRS[demo], env=env, stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True).stdout
+        report['demos'][demo] = json.loads(out.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''
+Measures the start-up cost of the demoTools imports of an inference job.
+
+Every variant runs in a fresh interpreter, several times, and the median is
+reported with the heavy notebook modules each one ends up loading:
+
+    bare          python -c pass, the interpreter itself
+    jobutils      from demoTools.jobutils import progressUpdate, what the jobs import
+    demoutils     from demoTools.demoutils import progressUpdate, heavy modules now lazy
+    notebook      the modules demoutils used to import eagerly (IPython, ipywidgets,
+                  matplotlib.pyplot) on top of demoutils, i.e. the former cost of the job import
+
+    python benchmarks/bench_imports.py --repeat 10
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY = ('IPython', 'ipywidgets', 'matplotlib')
+
+VARIANTS = {'bare': 'pass',
+            'jobutils': 'from demoTools.jobutils import progressUpdate',
+            'demoutils': 'from demoTools.demoutils import progressUpdate',
+            'notebook': ('from demoTools.demoutils import progressUpdate\n'
+                         'import IPython.display, ipywidgets, matplotlib.pyplot')}
+
+REPORT = ('import sys, json\n'
+          'print(json.dumps([m for m in {} if m in sys.modules]))').format(HEAVY)
+
+
+def run(code):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT), MPLBACKEND='Agg')
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code + '\n' + REPORT], cwd=ROOT, env=env,
+                         stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    return time.perf_counter() - start, json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', default=7, type=int, help="Interpreters started per variant")
+    args = parser.parse_args()
+
+    report = {'python': sys.version.split()[0], 'repeat': args.repeat}
+    for name, code in VARIANTS.items():
+        try:
+            run(code)  # warm the file system cache and the bytecode
+            samples = [run(code) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            report[name] = {'error': 'import failed'}
+            continue
+        report[name] = {'median_ms': round(1000 * statistics.median(t for t, _ in samples), 1),
+                        'heavy_modules': samples[0][1]}
+    if 'median_ms' in report.get('notebook', {}) and 'median_ms' in report.get('jobutils', {}):
+        report['saving_per_job_ms'] = round(report['notebook']['median_ms'] - report['jobutils']['median_ms'], 1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''
+Compares the ways the flaw detector can find the orientation of its objects:
+
+    legacy         per-point copy loop + cv2.PCACompute, one call per object (the original get_orientation)
+    pca            get_orientation(cnt): reshaped contour + cv2.PCACompute
+
+    python benchmarks/bench_orientation.py --objects 12 --frames 200
+
+The contours are found with cv2.findContours on synthetic frames of rotated
+rectangles and ellipses, like the thresholded frames of the flaw detector.
+Reports as JSON the time per frame and per object of the fastest run, the
+largest difference with the legacy angles, and how many objects get another
+orientation defect decision (angle >= 0.5) than with the legacy angles.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'python', 'flaw-detector-python'))
+from flawdetector import get_orientation
+
+DEFECT_ANGLE = 0.5
+
+
+def legacy_orientation(contours):
+    size_points = len(contours)
+    data_pts = np.empty((size_points, 2), dtype=np.float64)
+    for i in range(data_pts.shape[0]):
+        data_pts[i, 0] = contours[i, 0, 0]
+        data_pts[i, 1] = contours[i, 0, 1]
+    mean, eigenvector = cv2.PCACompute(data_pts, mean=None)
+    return np.arctan2(eigenvector[0, 1], eigenvector[0, 0])
+
+
+METHODS = {'legacy': lambda contours: [legacy_orientation(cnt) for cnt in contours],
+           'pca': lambda contours: [get_orientation(cnt) for cnt in contours]}
+
+
+def make_frames(count, objects, size, seed=0):
+    '''Contours of the objects of every synthetic frame'''
+    rng = np.random.RandomState(seed)
+    w, h = size
+    cell = w // objects
+    frames = []
+    for _ in range(count):
+        img = np.zeros((h, w), dtype=np.uint8)
+        for i in range(objects):
+            center = (i * cell + cell // 2, int(rng.randint(h // 4, 3 * h // 4)))
+            axes = (int(rng.randint(cell // 5, cell // 2 - 2)), int(rng.randint(h // 8, h // 4)))
+            angle = float(rng.uniform(0, 180))
+            if i % 2:
+                cv2.ellipse(img, center, axes, angle, 0, 360, 255, -1)
+            else:
+                box = cv2.boxPoints((center, (2 * axes[0], 2 * axes[1]), angle))
+                cv2.fillPoly(img, [np.int32(box)], 255)
+        contours = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)[-2]
+        frames.append(contours)
+    return frames
+
+
+def measure(method, frames, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for contours in frames:
+            method(contours)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', default=100, type=int, help="Synthetic frames")
+    parser.add_argument('--objects', default=12, type=int, help="Objects in every frame")
+    parser.add_argument('--width', default=1280, type=int)
+    parser.add_argument('--height', default=720, type=int)
+    parser.add_argument('--repeat', default=5, type=int, help="Runs per method, the fastest is reported")
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, args.objects, (args.width, args.height))
+    objects = sum(len(contours) for contours in frames)
+    reference = np.concatenate([METHODS['legacy'](contours) for contours in frames])
+    report = {'frames': args.frames, 'objects': objects,
+              'points_per_object': round(sum(len(c) for f in frames for c in f) / objects, 1)}
+    for name, method in METHODS.items():
+        angles = np.concatenate([np.asarray(method(contours), dtype=np.float64) for contours in frames])
+        elapsed = measure(method, frames, args.repeat)
+        report[name] = {'us_per_frame': round(1e6 * elapsed / args.frames, 1),
+                        'us_per_object': round(1e6 * elapsed / objects, 2),
+                        'max_abs_diff_rad': float(np.abs(angles - reference).max()),
+                        'decisions_changed': int(np.sum((angles >= DEFECT_ANGLE) != (reference >= DEFECT_ANGLE)))}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
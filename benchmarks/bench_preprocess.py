@@ -0,0 +1,98 @@
+'''
+Compares the per-frame cost of preparing the network input:
+
+    legacy   cv2.resize + transpose + reshape, copied into the request by start_async
+    ring     Preprocessor.fill into a ring buffer, copied into the request by start_async
+    inplace  Preprocessor.fill straight into the input blob of the request
+
+    python benchmarks/bench_preprocess.py --width 1920 --height 1080 --net 544x320 --blob f32
+
+Reports the mean time per frame of the fastest run and the peak memory allocated
+while preprocessing (tracemalloc tracks numpy allocations) as JSON.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from demoTools.preprocess import Preprocessor
+
+
+# Every method returns the function preprocessing one frame into blob, set up outside the measurements
+
+def legacy(blob):
+    n, c, h, w = blob.shape
+
+    def step(frame):
+        in_frame = cv2.resize(frame, (w, h))
+        in_frame = in_frame.transpose((2, 0, 1))
+        blob[...] = in_frame.reshape((n, c, h, w))
+    return step
+
+
+def ring(blob):
+    preprocessor = Preprocessor(blob.shape, buffers=4)
+
+    def step(frame):
+        blob[...] = preprocessor.fill(frame)
+    return step
+
+
+def inplace(blob):
+    preprocessor = Preprocessor(blob.shape)
+
+    def step(frame):
+        preprocessor.fill(frame, blob)
+    return step
+
+
+def measure(method, frames, blob, repeat):
+    step = method(blob)
+    step(frames[0])
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            step(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    for frame in frames:
+        step(frame)
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'us_per_frame': round(1e6 * best / len(frames), 1),
+            'peak_allocated_kb': round(allocated / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', default=200, type=int, help="Frames preprocessed per run")
+    parser.add_argument('--width', default=1280, type=int, help="Width of the decoded frames")
+    parser.add_argument('--height', default=720, type=int, help="Height of the decoded frames")
+    parser.add_argument('--net', default='300x300', help="Network input as WxH")
+    parser.add_argument('--blob', default='u8', choices=['u8', 'f32'], help="Precision of the request input blob")
+    parser.add_argument('--repeat', default=5, type=int, help="Runs per method, the fastest is reported")
+    args = parser.parse_args()
+
+    w, h = (int(v) for v in args.net.split('x'))
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 255, size=(args.height, args.width, 3)).astype(np.uint8) for _ in range(8)]
+    frames = (frames * (args.frames // len(frames) + 1))[:args.frames]
+    blob = np.zeros((1, 3, h, w), dtype=np.uint8 if args.blob == 'u8' else np.float32)
+
+    report = {'frames': args.frames, 'input': [args.width, args.height], 'net': [w, h], 'blob': args.blob}
+    for name, method in (('legacy', legacy), ('ring', ring), ('inplace', inplace)):
+        report[name] = measure(method, frames, blob, args.repeat)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
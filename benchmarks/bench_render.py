@@ -0,0 +1,59 @@
+'''
+Compares the wall time of the serial post_process renderer with the
+multi-process post_process_parallel on a synthetic video.
+
+    python benchmarks/bench_render.py --frames 600 --objects 20 --workers 8
+'''
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'python', 'object-detection-python'))
+import out_process
+from synthetic import make_video, make_results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', default=600, type=int, help="Frames in the synthetic video")
+    parser.add_argument('--width', default=1280, type=int)
+    parser.add_argument('--height', default=720, type=int)
+    parser.add_argument('--objects', default=10, type=int, help="Detections per frame")
+    parser.add_argument('--workers', default=os.cpu_count(), type=int, help="Worker processes of the parallel renderer")
+    parser.add_argument('--workdir', default=None, help="Directory for the synthetic input and rendered videos")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_render_')
+    os.makedirs(workdir, exist_ok=True)
+    video = os.path.join(workdir, 'input.mp4')
+    results = os.path.join(workdir, 'results.bin')
+    tracks = make_video(video, args.frames, (args.width, args.height), objects=args.objects)
+    make_results(results, tracks)
+
+    start = time.time()
+    out_process.post_process(video, results, None, 0.5, os.path.join(workdir, 'serial.mp4'), None, True)
+    serial = time.time() - start
+
+    start = time.time()
+    out_process.post_process_parallel(video, results, None, 0.5, os.path.join(workdir, 'parallel.mp4'), None, True,
+                                      workers=args.workers)
+    parallel = time.time() - start
+
+    print(json.dumps({'frames': args.frames,
+                      'resolution': [args.width, args.height],
+                      'objects_per_frame': args.objects,
+                      'workers': args.workers,
+                      'serial_s': round(serial, 3),
+                      'parallel_s': round(parallel, 3),
+                      'speedup': round(serial / parallel, 2),
+                      'workdir': workdir}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Synthetic inputs for the benchmarks: a video of objects moving over a noisy
+background and detection results that follow them, so every benchmark can run
+without the DevCloud sample data.
+'''
+
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from demoTools.detections import RESULT_DTYPE
+
+
+def _tracks(frames, size, objects, seed):
+    '''Box of every object in every frame as an array of shape [frames, objects, 4] in pixels'''
+    width, height = size
+    rng = np.random.RandomState(seed)
+    box = rng.uniform(0.05, 0.2, size=(objects, 2)) * (width, height)
+    start = rng.uniform(0, 1, size=(objects, 2)) * ((width, height) - box)
+    speed = rng.uniform(-4, 4, size=(objects, 2))
+    t = np.arange(frames)[:, None, None]
+    pos = start + speed * t
+    span = (width, height) - box
+    # Bounce off the borders
+    pos = np.abs((pos + span) % (2 * span) - span)
+    return np.concatenate([pos, pos + box], axis=2).astype(np.int32)
+
+
+def make_video(path, frames=300, size=(1280, 720), fps=30.0, objects=8, seed=0):
+    '''Writes a video of moving rectangles to path and returns the object tracks'''
+    width, height = size
+    tracks = _tracks(frames, size, objects, seed)
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 60, size=(height, width, 3)).astype(np.uint8)
+    colors = rng.randint(80, 255, size=(objects, 3)).tolist()
+    vw = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height), True)
+    for i in range(frames):
+        frame = background.copy()
+        for (xmin, ymin, xmax, ymax), color in zip(tracks[i].tolist(), colors):
+            cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, -1)
+        vw.write(frame)
+    vw.release()
+    return tracks
+
+
+def make_results(path, tracks, det_time=0.02, seed=0):
+    '''Writes a binary result file (see demoTools/detections.py) with one record per tracked object'''
+    frames, objects, _ = tracks.shape
+    rng = np.random.RandomState(seed)
+    boxes = np.empty(frames * objects, dtype=RESULT_DTYPE)
+    boxes['frame'] = np.repeat(np.arange(frames), objects)
+    flat = tracks.reshape(-1, 4)
+    for i, name in enumerate(('xmin', 'ymin', 'xmax', 'ymax')):
+        boxes[name] = flat[:, i]
+    boxes['class_id'] = np.tile(np.arange(1, objects + 1), frames)
+    boxes['confidence'] = rng.uniform(0.5, 1.0, size=len(boxes))
+    boxes['det_time'] = det_time
+    boxes.tofile(path)
+    return boxes
@@ -1,14 +1,38 @@
-from IPython.core.display import HTML
+'''
+Notebook side of the demos: videos, plots, live qstat and progress bars.
+
+IPython, ipywidgets and matplotlib are only imported by the functions using
+them, on their first call. The jobs import demoTools.jobutils instead, whose
+progressUpdate and writeStats are also available from here.
+'''
 import threading
-from IPython.display import display, Image
-import ipywidgets as widgets
 import time
-import queue
-import subprocess
 import datetime
-import matplotlib
-import matplotlib.pyplot as plt
+import importlib
 import os 
+import sys
+from demoTools.jobutils import progressUpdate, readProgress, writeStats
+from demoTools.metrics import STAGES, load_metrics
+from demoTools.qstat import QstatJob, qstat_poller
+
+# Names this module used to import eagerly, loaded on first access
+_LAZY = {'HTML': ('IPython.core.display', 'HTML'),
+         'display': ('IPython.display', 'display'),
+         'Image': ('IPython.display', 'Image'),
+         'widgets': ('ipywidgets', None),
+         'matplotlib': ('matplotlib', None),
+         'plt': ('matplotlib.pyplot', None)}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    module, attr = _LAZY[name]
+    value = importlib.import_module(module)
+    if attr:
+        value = getattr(value, attr)
+    globals()[name] = value
+    return value
 
 
 def videoHTML(title, videos_list, stats=None):
@@ -29,19 +53,26 @@ def videoHTML(title, videos_list, stats=None):
     height = '480' if len(videos_list) == 1 else '240'
     for x in range(len(videos_list)):
         video_string += "<video alt=\"\" controls autoplay height=\""+height+"\"><source src=\""+videos_list[x]+"\" type=\"video/mp4\" /></video>"
+    from IPython.core.display import HTML
     return HTML('''<h2>{title}</h2>
     {stats_line}
     {videos}
     '''.format(title=title, videos=video_string, stats_line=stats_line))
 
 
-def summaryPlot(results_dict, x_axis, y_axis, title):
+def summaryPlot(results_dict, x_axis, y_axis, title, stages=None):
     ''' Bar plot input:
 	results_dict: dictionary of path to result file and label {path_to_result:label}
+	              stats.txt files give one bar per result, metrics files (metrics.json or .csv,
+	              see metrics.py) one bar per result split by stage
 	x_axis: label of the x axis
 	y_axis: label of the y axis
 	title: title of the graph
+	stages: stages stacked in the bars of metrics files, all the recorded stages by default
     '''
+    if any(path.endswith(('.json', '.csv')) for path in results_dict):
+        return stagePlot(results_dict, x_axis, y_axis, title, stages)
+    import matplotlib.pyplot as plt
     plt.figure()
     plt.title(title)
     plt.ylabel(y_axis)
@@ -73,35 +104,167 @@ def summaryPlot(results_dict, x_axis, y_axis, title):
     plt.bar(arch, time, width=0.8, align='center')
 
 
-def liveQstat():
-    cmd = ['qstat']
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    output,_ = p.communicate()
-    now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    qstat = widgets.Output(layout={'width': '100%', 'border': '1px solid gray'})
-    stop_signal_q = queue.Queue()
-
-    def _work(qstat,stop_signal_q):
-        while stop_signal_q.empty():
-            cmd = ['qstat']
-            p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-            output,_ = p.communicate()
-            now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            qstat.append_stdout(now+'\n'+output.decode()+'\n\n\n')
-            qstat.clear_output(wait=True)
-            time.sleep(1.0)
-        print('liveQstat stopped')
-    thread = threading.Thread(target=_work, args=(qstat, stop_signal_q))
-
-    thread.start()
+def stagePlot(results_dict, x_axis, y_axis, title, stages=None):
+    ''' Stacked bar plot of the total time spent in every stage, input:
+	results_dict: dictionary of path to metrics file and label {path_to_metrics:label}
+	x_axis: label of the x axis
+	y_axis: label of the y axis
+	title: title of the graph
+	stages: stages to stack, all the recorded stages by default
+	Stages running on separate threads overlap, their sum can exceed the processing time
+    '''
+    import matplotlib.pyplot as plt
+    plt.figure()
+    plt.title(title)
+    plt.ylabel(y_axis)
+    plt.xlabel(x_axis)
+    arch = list(results_dict.values())
+    metrics = [load_metrics(path) if os.path.isfile(path) else None for path in results_dict]
+    if stages is None:
+        recorded = set(name for m in metrics if m for name in m['stages'])
+        stages = [s for s in STAGES if s in recorded] + sorted(recorded - set(STAGES))
+    bottom = [0] * len(arch)
+    for stage in stages:
+        values = [m['stages'][stage]['total_s'] if m and stage in m['stages'] else 0 for m in metrics]
+        plt.bar(arch, values, bottom=bottom, width=0.8, align='center', label=stage)
+        bottom = [b + v for b, v in zip(bottom, values)]
+    offset = max(bottom + [1])/100
+    for diff, (m, total) in enumerate(zip(metrics, bottom)):
+        data = round(total, 1) if m else 'N/A'
+        plt.text(diff, total + offset, data, fontsize=10, multialignment="center",horizontalalignment="center", verticalalignment="bottom",  color='black')
+    plt.ylim(top=(max(bottom + [1])+10*offset))
+    plt.legend()
+
+
+def _qstatRow(job):
+    return "<pre style='margin:0'>{:<25} {:<16} {:<15} {:>8} {} {}</pre>".format(
+        job.id, job.name, job.user, job.time_use, job.state, job.queue)
+
+
+def liveQstat(poller=None):
+    '''
+	Live view of the job queue, updated by the shared QstatPoller (see qstat.py)
+	poller: QstatPoller to subscribe to, the one of the process by default
+	Only the rows of the jobs that changed are redrawn
+    '''
+    import ipywidgets as widgets
+    from IPython.display import display
+    poller = poller or qstat_poller()
+    header = widgets.HTML(value=_qstatRow(QstatJob('Job ID', 'Name', 'User', 'Time Use', 'S', 'Queue')))
+    status = widgets.HTML(value='')
+    rows = widgets.VBox([])
+    row_widgets = {}
+    qstat = widgets.VBox([status, header, rows], layout={'width': '100%', 'border': '1px solid gray'})
+
+    def _update(diff):
+        for job_id in diff.removed:
+            row_widgets.pop(job_id, None)
+        for job_id, (old, job) in diff.changed.items():
+            if job_id in row_widgets:
+                row_widgets[job_id].value = _qstatRow(job)
+        for job_id, job in diff.added.items():
+            if job_id not in row_widgets:
+                row_widgets[job_id] = widgets.HTML(value=_qstatRow(job))
+        if diff.added or diff.removed:
+            rows.children = [row_widgets[job_id] for job_id in diff.jobs if job_id in row_widgets]
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        error = ' ({})'.format(poller.error) if poller.error else ''
+        status.value = 'Last change: {}{}'.format(now, error)
+
+    poller.subscribe(_update)
     sb = widgets.Button(description='Stop')
     def _stop_qstat(evt):
-        stop_signal_q.put(True)
+        poller.unsubscribe(_update)
+        status.value += ' - liveQstat stopped'
     sb.on_click(_stop_qstat)
     display(qstat)
     display(sb)
 
-   
+
+# Seconds between two checks of the progress files
+PROGRESS_POLL_INTERVAL = 0.5
+
+
+class ProgressPoller:
+    '''
+	Single thread watching the progress files of all the progress bars of the notebook: it checks
+	the files at a fixed rate and only reads the ones whose modification time, size or inode changed
+    '''
+    def __init__(self, interval=PROGRESS_POLL_INTERVAL):
+        self.interval = interval
+        self.files = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def watch(self, path, update, done):
+        '''
+	path: progress file
+	update: called with the values of readProgress when the file changes
+	done: called once the progress reached 100, the file is then removed
+        '''
+        with self.lock:
+            self.files[path] = {'signature': None, 'update': update, 'done': done}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='progress')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.files:
+                        # Restarted by the next watch()
+                        self.thread = None
+                        return
+                    files = list(self.files.items())
+                for path, watched in files:
+                    try:
+                        self._poll(path, watched)
+                    except Exception as e:
+                        # A bad file or callback only stops its own progress bar
+                        print("Stopped watching {}: {!r}".format(path, e), file=sys.stderr)
+                        with self.lock:
+                            if self.files.get(path) is watched:
+                                del self.files[path]
+                time.sleep(self.interval)
+        finally:
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+    def _poll(self, path, watched):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # Listing the directory refreshes the attributes NFS clients cache for it, so that
+            # the file shows up as soon as the job creates it
+            try:
+                os.listdir(os.path.dirname(path) or '.')
+            except OSError:
+                pass
+            return
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if signature == watched['signature']:
+            return
+        values = readProgress(path)
+        if values is None:
+            return
+        watched['signature'] = signature
+        watched['update'](*values)
+        if float(values[0]) >= 100:
+            with self.lock:
+                del self.files[path]
+            watched['done']()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+_progress_poller = ProgressPoller()
+
+
 def progressIndicator(path, file_name , title, min_, max_):
     '''
 	Progress indicator reads first line in the file "path" 
@@ -111,7 +274,10 @@ def progressIndicator(path, file_name , title, min_, max_):
 	min_: min_ value for the progress bar
 	max_: max value in the progress bar
 
+	All the progress bars are updated by the thread of ProgressPoller
     '''
+    import ipywidgets as widgets
+    from IPython.display import display
     style = {'description_width': 'initial'}
     progress_bar = widgets.FloatProgress(
     value=0.0,
@@ -143,49 +309,17 @@ def progressIndicator(path, file_name , title, min_, max_):
         os.makedirs(path, exist_ok=True)
     f = open(path+'/'+file_name, "w")
     f.close()
-    
-    def _work(progress_bar, est_time,remain_time,  path):
-        box_layout = widgets.Layout(display='flex', flex_flow='column', align_items='stretch', border='ridge', width='70%', height='')
-        box = widgets.HBox([progress_bar, est_time, remain_time], layout=box_layout)
-        display(box)
-        # progress
-        last_status = 0.0
-        remain_val = '0'
-        est_val = '0'
-        output_file = path
-        while last_status < 100:
-            if os.path.isfile(output_file):
-                with open(output_file, "r") as fh:
-                    line1 = fh.readline() 	#Progress 
-                    line2 = fh.readline()  	#Remaining time
-                    line3 = fh.readline()  	#Estimated total time
-                    if line1 and line2 and line3:
-                        last_status = float(line1)
-                        remain_val = line2
-                        est_val = line3
-                    progress_bar.value = last_status
-                    remain_time.value = remain_val+' seconds' 
-                    est_time.value = est_val+' seconds' 
-            else:
-                cmd = ['ls']
-                p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-                output,_ = p.communicate()
-        remain_time.value = '0'+' seconds' 
-        time.sleep(1)
-        os.remove(output_file)
-
-
-    thread = threading.Thread(target=_work, args=(progress_bar, est_time, remain_time, os.path.join(path, file_name)))
-    thread.start()
-    time.sleep(0.1)
-
-
-
-def progressUpdate(file_name, time_diff, frame_count, video_len):
-    progress = round(100*(frame_count/video_len), 1)
-    remaining_time = round((time_diff/frame_count)*(video_len-frame_count), 1)
-    estimated_time = round((time_diff/frame_count)*video_len, 1)
-    with  open(file_name, "w") as progress_file:
-        progress_file.write(str(progress)+'\n')
-        progress_file.write(str(remaining_time)+'\n')
-        progress_file.write(str(estimated_time)+'\n')
+
+    box_layout = widgets.Layout(display='flex', flex_flow='column', align_items='stretch', border='ridge', width='70%', height='')
+    box = widgets.HBox([progress_bar, est_time, remain_time], layout=box_layout)
+    display(box)
+
+    def _update(progress, remain_val, est_val):
+        progress_bar.value = float(progress)
+        remain_time.value = remain_val+' seconds'
+        est_time.value = est_val+' seconds'
+
+    def _done():
+        remain_time.value = '0'+' seconds'
+
+    _progress_poller.watch(os.path.join(path, file_name), _update, _done)
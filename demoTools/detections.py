@@ -0,0 +1,112 @@
+'''
+Vectorized handling of SSD detection output and of the result files written by the demos.
+
+SSD networks output a [1, 1, N, 7] blob whose rows are
+[image_id, label, conf, x_min, y_min, x_max, y_max], coordinates relative to the image size.
+
+Result files hold one record per detection above the threshold:
+    text    one "frame xmin ymin xmax ymax class_id confidence(%) det_time(ms)" line per detection,
+            the format read by ROI_writer
+    binary  fixed-size little-endian RESULT_DTYPE records (confidence as a probability,
+            det_time in seconds) in frame order, to be memory-mapped with load_results()
+'''
+
+import os
+
+import numpy as np
+
+RESULT_DTYPE = np.dtype([('frame', '<i4'),
+                         ('xmin', '<i4'), ('ymin', '<i4'), ('xmax', '<i4'), ('ymax', '<i4'),
+                         ('class_id', '<i4'),
+                         ('confidence', '<f4'),
+                         ('det_time', '<f4')])
+
+TEXT_FORMAT = '%d %d %d %d %d %d %.1f %d \n'
+
+
+def filter_detections(res, prob_threshold, initial_w, initial_h, frame=0, det_time=0.0):
+    '''
+    Selects the detections of res above prob_threshold and scales them to the frame size.
+    res: detection output of one request, any shape ending with 7
+    frame: frame number stored in the records, a scalar or one value per image of the batch
+    Returns an array of RESULT_DTYPE records
+    '''
+    dets = res.reshape(-1, 7)
+    dets = dets[dets[:, 2] > prob_threshold]
+    boxes = np.empty(len(dets), dtype=RESULT_DTYPE)
+    if np.ndim(frame):
+        boxes['frame'] = np.asarray(frame)[dets[:, 0].astype(np.int32)]
+    else:
+        boxes['frame'] = frame
+    boxes['xmin'] = dets[:, 3] * initial_w
+    boxes['ymin'] = dets[:, 4] * initial_h
+    boxes['xmax'] = dets[:, 5] * initial_w
+    boxes['ymax'] = dets[:, 6] * initial_h
+    boxes['class_id'] = dets[:, 1]
+    boxes['confidence'] = dets[:, 2]
+    boxes['det_time'] = det_time
+    return boxes
+
+
+def format_text(boxes):
+    '''Formats RESULT_DTYPE records as result file lines with a single string operation.'''
+    if not len(boxes):
+        return ''
+    columns = np.empty((len(boxes), 8), dtype=np.float64)
+    for i, name in enumerate(('frame', 'xmin', 'ymin', 'xmax', 'ymax', 'class_id')):
+        columns[:, i] = boxes[name]
+    columns[:, 6] = np.round(boxes['confidence'] * np.float32(100), 1)
+    columns[:, 7] = np.round(boxes['det_time'].astype(np.float64) * 1000)
+    return (TEXT_FORMAT * len(boxes)) % tuple(columns.ravel().tolist())
+
+
+class ResultWriter:
+    def __init__(self, text_path=None, binary_path=None):
+        self.text_file = open(text_path, 'w') if text_path else None
+        self.binary_file = open(binary_path, 'wb') if binary_path else None
+
+    def write(self, boxes):
+        if self.text_file is not None:
+            self.text_file.write(format_text(boxes))
+        if self.binary_file is not None:
+            boxes.tofile(self.binary_file)
+
+    def close(self):
+        for f in (self.text_file, self.binary_file):
+            if f is not None:
+                f.close()
+
+
+def load_results(path):
+    '''Memory-maps a binary result file as an array of RESULT_DTYPE records.'''
+    if not os.path.getsize(path):
+        return np.empty(0, dtype=RESULT_DTYPE)
+    return np.memmap(path, dtype=RESULT_DTYPE, mode='r')
+
+
+def iter_frames(boxes, num_frames=None):
+    '''
+    Yields (frame, records) for every frame in order, with an empty slice for frames without detections.
+    boxes: records sorted by frame, e.g. a memory-mapped result file; only the current frame is read
+    num_frames: keep yielding empty frames up to this count after the last record
+    '''
+    frames = boxes['frame']
+    frame = 0
+    start = 0
+    while start < len(boxes) or (num_frames is not None and frame < num_frames):
+        end = start + int(np.searchsorted(frames[start:], frame, side='right'))
+        yield frame, boxes[start:end]
+        start = end
+        frame += 1
+
+
+def load_text_results(path):
+    '''Reads a text result file into an array of RESULT_DTYPE records.'''
+    table = np.loadtxt(path, ndmin=2)
+    boxes = np.empty(len(table), dtype=RESULT_DTYPE)
+    if len(table):
+        for i, name in enumerate(('frame', 'xmin', 'ymin', 'xmax', 'ymax', 'class_id')):
+            boxes[name] = table[:, i]
+        boxes['confidence'] = table[:, 6] / 100
+        boxes['det_time'] = table[:, 7] / 1000
+    return boxes
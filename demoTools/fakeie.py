@@ -0,0 +1,173 @@
+'''
+Stand-in for openvino.inference_engine so the demos can be run, tested and
+benchmarked on machines without OpenVINO or an accelerator.
+
+Only the parts of the IEPlugin / IENetwork / ExecutableNetwork API used by the
+demos are implemented. The simulated device is configured through environment
+variables so it can be selected from job scripts:
+
+    FAKE_IE_LATENCY     seconds a single request spends on the device (0.01)
+    FAKE_IE_PARALLEL    number of requests the device runs concurrently (1)
+    FAKE_IE_INPUT       input shape of the network as NxCxHxW (1x3x300x300)
+    FAKE_IE_DETECTIONS  rows per image in the [1,1,N,7] output blob (100)
+
+Outputs are a pure function of the input data, so two runs over the same video
+produce the same detections.
+'''
+
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+# Status codes returned by InferRequest.wait()
+OK = 0
+RESULT_NOT_READY = -9
+
+
+def _env_shape(name, default):
+    if name in os.environ:
+        return [int(x) for x in os.environ[name].lower().split('x')]
+    return list(default)
+
+
+class _Device:
+    '''Executes submitted requests on a fixed number of lanes with a fixed latency.'''
+
+    def __init__(self, name, latency=None, parallel=None):
+        self.name = name
+        self.latency = float(os.environ.get('FAKE_IE_LATENCY', 0.01)) if latency is None else latency
+        self.parallel = int(os.environ.get('FAKE_IE_PARALLEL', 1)) if parallel is None else parallel
+        self.jobs = queue.Queue()
+        for _ in range(self.parallel):
+            threading.Thread(target=self._lane, daemon=True).start()
+
+    def _lane(self):
+        while True:
+            request = self.jobs.get()
+            time.sleep(self.latency)
+            request._run()
+
+
+class _LayerInfo:
+    def __init__(self, shape):
+        self.shape = list(shape)
+
+
+class IENetwork:
+    def __init__(self, model=None, weights=None):
+        self.model = model
+        self.weights = weights
+        self.detections = int(os.environ.get('FAKE_IE_DETECTIONS', 100))
+        self.inputs = {'data': _LayerInfo(_env_shape('FAKE_IE_INPUT', (1, 3, 300, 300)))}
+        self.outputs = {'detection_out': _LayerInfo(self._output_shape())}
+        self.layers = {'data': None, 'detection_out': None}
+
+    @classmethod
+    def from_ir(cls, model, weights):
+        return cls(model, weights)
+
+    def _output_shape(self):
+        return [1, 1, self.detections * self.batch_size, 7]
+
+    @property
+    def batch_size(self):
+        return self.inputs['data'].shape[0]
+
+    @batch_size.setter
+    def batch_size(self, batch):
+        self.inputs['data'].shape[0] = batch
+        self.outputs['detection_out'].shape = self._output_shape()
+
+    def reshape(self, input_shapes):
+        for name, shape in input_shapes.items():
+            self.inputs[name].shape = list(shape)
+        self.outputs['detection_out'].shape = self._output_shape()
+
+
+class InferRequest:
+    def __init__(self, device, net):
+        self._device = device
+        self._detections = net.detections
+        self.inputs = {k: np.zeros(v.shape, dtype=np.float32) for k, v in net.inputs.items()}
+        self.outputs = {k: np.zeros(v.shape, dtype=np.float32) for k, v in net.outputs.items()}
+        self._done = threading.Event()
+        self._done.set()
+
+    def async_infer(self, inputs=None):
+        if inputs:
+            for name, data in inputs.items():
+                self.inputs[name][...] = data
+        self._done.clear()
+        self._device.jobs.put(self)
+
+    def infer(self, inputs=None):
+        self.async_infer(inputs)
+        self.wait(-1)
+
+    def wait(self, timeout=-1):
+        '''timeout in milliseconds; -1 blocks until the request is done, 0 only polls'''
+        if timeout < 0:
+            self._done.wait()
+        elif not self._done.wait(timeout / 1000.0):
+            return RESULT_NOT_READY
+        return OK
+
+    def _run(self):
+        data = next(iter(self.inputs.values()))
+        out = next(iter(self.outputs.values()))
+        out[...] = 0
+        rows = out.reshape(-1, 7)
+        n = self._detections
+        for b in range(data.shape[0]):
+            rng = np.random.RandomState(int(data[b].sum()) & 0xffffffff)
+            k = rng.randint(0, n // 4 + 1)
+            block = rows[b * n:(b + 1) * n]
+            corner = rng.uniform(0.0, 0.8, size=(k, 2))
+            size = rng.uniform(0.05, 0.2, size=(k, 2))
+            block[:k, 0] = b
+            block[:k, 1] = rng.randint(1, 21, size=k)
+            block[:k, 2] = rng.uniform(0.05, 1.0, size=k)
+            block[:k, 3:5] = corner
+            block[:k, 5:7] = corner + size
+            block[k:, 0] = -1
+        self._done.set()
+
+
+class ExecutableNetwork:
+    def __init__(self, device, net, num_requests):
+        self.requests = [InferRequest(device, net) for _ in range(num_requests)]
+        self._device = device
+
+    def start_async(self, request_id, inputs=None):
+        self.requests[request_id].async_infer(inputs)
+        return self.requests[request_id]
+
+    def infer(self, inputs=None):
+        self.requests[0].infer(inputs)
+        return self.requests[0].outputs
+
+    def get_metric(self, name):
+        if name == 'OPTIMAL_NUMBER_OF_INFER_REQUESTS':
+            return self._device.parallel + 1
+        raise ValueError("Unsupported metric " + name)
+
+
+class IEPlugin:
+    def __init__(self, device, plugin_dirs=None):
+        self.device = device
+        self._device = _Device(device)
+
+    def add_cpu_extension(self, extension_path):
+        pass
+
+    def set_config(self, config):
+        pass
+
+    def get_supported_layers(self, net):
+        return set(net.layers)
+
+    def load(self, network, num_requests=1, config=None):
+        return ExecutableNetwork(self._device, network, num_requests)
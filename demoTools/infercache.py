@@ -0,0 +1,328 @@
+'''
+On-disk cache of the raw network outputs of the demos.
+
+Running a demo again with another probability threshold or labels file does
+not change what the network outputs, only how the outputs are filtered. The
+SSD detections of every frame are therefore kept on disk, keyed by the content
+of the input video, the content of the IR (.xml and .bin), the device, the
+input shape and the frame selection of the demo. A later run with the same key
+reads them back from a memory-mapped file instead of decoding and inferring:
+
+    cache = InferCache('/tmp/infer_cache')
+    key = cache.key(video, model_xml, device, (n, c, h, w))
+    cached = cache.lookup(key)
+    if cached is not None:
+        for i in range(len(cached)):
+            frame_no, output, det_time = cached.frame(i)     # output: rows of 7 values
+    else:
+        writer = cache.writer(key, video=video, model=model_xml, device=device)
+        writer.append(frame_no, result.output, result.det_time)   # for every frame in order
+        writer.commit()   # only once the whole video went through the network, abort() otherwise
+
+Every entry is three files in the cache directory:
+    <key>.rows    float32 rows [image_id, label, conf, x_min, y_min, x_max, y_max] of all the frames
+    <key>.frames  one FRAME_DTYPE record per frame: frame number, first row, row count, det_time
+    <key>.json    description of the entry, written last so that only complete entries are found
+
+Padding rows (image_id < 0, the end of the detections of an image) are not stored.
+The modification time of <key>.json is the last use of the entry: once the
+cache grows over max_bytes, the least recently used entries are removed.
+
+The directory defaults to $INFER_CACHE_DIR, its size to $INFER_CACHE_MAX_MB
+(2048). It is inspected and purged with
+
+    python3 -m demoTools.infercache list
+    python3 -m demoTools.infercache purge --older_than 7
+    python3 -m demoTools.infercache purge --all
+'''
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+INFER_CACHE_MAX_MB = 2048
+
+FRAME_DTYPE = np.dtype([('frame', '<i8'), ('offset', '<i8'), ('count', '<i4'), ('det_time', '<f4')])
+
+HASH_CHUNK = 1 << 20
+HASHES_FILE = 'hashes.json'
+ENTRY_FILES = ('.rows', '.frames', '.json')
+
+
+def default_directory():
+    return os.environ.get('INFER_CACHE_DIR') or None
+
+
+def default_max_bytes():
+    return int(float(os.environ.get('INFER_CACHE_MAX_MB', INFER_CACHE_MAX_MB)) * (1 << 20))
+
+
+class CachedOutputs:
+    '''Outputs of one entry, memory-mapped'''
+    def __init__(self, key, info, frames, rows):
+        self.key = key
+        self.info = info
+        self.frames = frames
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, i):
+        '''Returns (frame number, output rows, det_time) of the i-th frame the entry was recorded with'''
+        record = self.frames[i]
+        offset = int(record['offset'])
+        return int(record['frame']), self.rows[offset:offset + int(record['count'])], float(record['det_time'])
+
+
+class CacheWriter:
+    '''Appends the outputs of the frames of a new entry to temporary files, see InferCache.writer()'''
+    def __init__(self, cache, key, info):
+        self.cache = cache
+        self.key = key
+        self.info = info
+        self.tmp = os.path.join(cache.directory, '{}.{}.tmp'.format(key, os.getpid()))
+        self.rows_file = open(self.tmp + '.rows', 'wb')
+        self.frames = []
+        self.count = 0
+        self.closed = False
+
+    def append(self, frame_no, output, det_time=0.0):
+        rows = np.asarray(output, dtype=np.float32).reshape(-1, 7)
+        rows = rows[rows[:, 0] >= 0]
+        rows.tofile(self.rows_file)
+        self.frames.append((frame_no, self.count, len(rows), det_time))
+        self.count += len(rows)
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.rows_file.close()
+        for ext in ('.rows', '.frames', '.json'):
+            try:
+                os.remove(self.tmp + ext)
+            except OSError:
+                pass
+
+    def commit(self):
+        '''Publishes the entry and evicts the least recently used entries over the size of the cache'''
+        if self.closed:
+            return
+        if not self.frames:
+            self.abort()
+            return
+        self.closed = True
+        self.rows_file.close()
+        np.array(self.frames, dtype=FRAME_DTYPE).tofile(self.tmp + '.frames')
+        info = dict(self.info, key=self.key, frames=len(self.frames), rows=self.count, created=time.time())
+        with open(self.tmp + '.json', 'w') as f:
+            json.dump(info, f, indent=2)
+        base = os.path.join(self.cache.directory, self.key)
+        for ext in ENTRY_FILES:
+            os.replace(self.tmp + ext, base + ext)
+        self.cache.evict(keep=(self.key,))
+
+
+class InferCache:
+    def __init__(self, directory=None, max_bytes=None):
+        '''
+        directory: directory of the cache, $INFER_CACHE_DIR by default
+        max_bytes: size the cache is kept under, $INFER_CACHE_MAX_MB megabytes by default
+        '''
+        self.directory = directory or default_directory()
+        if not self.directory:
+            raise ValueError("No cache directory given and INFER_CACHE_DIR is not set")
+        self.max_bytes = default_max_bytes() if max_bytes is None else max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def file_digest(self, path):
+        '''
+        sha256 of the content of a file, remembered by path, size and modification time so that
+        a video is only read once. Returns None if the file does not exist
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        name = '{}:{}:{}'.format(os.path.realpath(path), st.st_size, st.st_mtime_ns)
+        hashes_path = os.path.join(self.directory, HASHES_FILE)
+        try:
+            with open(hashes_path) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            hashes = {}
+        if name in hashes:
+            return hashes[name]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        hashes[name] = digest.hexdigest()
+        # Forget the files that changed or disappeared since they were hashed
+        for old in list(hashes):
+            path_name = old.rsplit(':', 2)[0]
+            if path_name == os.path.realpath(path) and old != name or not os.path.exists(path_name):
+                del hashes[old]
+        tmp = '{}.{}.tmp'.format(hashes_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(hashes, f)
+        os.replace(tmp, hashes_path)
+        return hashes[name]
+
+    def key(self, video, model_xml, device, input_shape, **params):
+        '''
+        Key of the outputs of the network model_xml on device for the frames of video
+        input_shape: (n, c, h, w) input shape of the network
+        params: anything else changing which frames are inferred or how, e.g. the frame rate of a stream
+        '''
+        model_bin = os.path.splitext(model_xml)[0] + '.bin'
+        fields = {'video': self.file_digest(video) or os.path.abspath(video),
+                  # Without the IR files (e.g. the fake inference engine) the model is known by its name
+                  'model': [self.file_digest(path) or os.path.basename(path) for path in (model_xml, model_bin)],
+                  'device': device,
+                  'input_shape': [int(x) for x in input_shape],
+                  'params': params}
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:32]
+
+    def lookup(self, key):
+        '''The CachedOutputs of key, None if it is not cached'''
+        meta = self._path(key, '.json')
+        try:
+            with open(meta) as f:
+                info = json.load(f)
+            frames = np.memmap(self._path(key, '.frames'), dtype=FRAME_DTYPE, mode='r')
+            if info['rows']:
+                rows = np.memmap(self._path(key, '.rows'), dtype=np.float32, mode='r', shape=(info['rows'], 7))
+            else:
+                rows = np.empty((0, 7), dtype=np.float32)
+            os.utime(meta)
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(frames) != info['frames']:
+            return None
+        return CachedOutputs(key, info, frames, rows)
+
+    def writer(self, key, **info):
+        '''A CacheWriter for the outputs of key; info is stored with the entry and shown by list'''
+        return CacheWriter(self, key, info)
+
+    def entries(self):
+        '''Description of every entry, least recently used first, with its size and last use'''
+        entries = []
+        for meta in glob.glob(os.path.join(self.directory, '*.json')):
+            key = os.path.splitext(os.path.basename(meta))[0]
+            if key + '.json' == HASHES_FILE:
+                continue
+            try:
+                with open(meta) as f:
+                    info = json.load(f)
+                last_used = os.stat(meta).st_mtime
+            except (OSError, ValueError):
+                continue
+            size = 0
+            for ext in ENTRY_FILES:
+                try:
+                    size += os.path.getsize(self._path(key, ext))
+                except OSError:
+                    pass
+            entries.append(dict(info, key=key, size=size, last_used=last_used))
+        entries.sort(key=lambda entry: entry['last_used'])
+        return entries
+
+    def remove(self, key):
+        # The description goes first, a half removed entry is never looked up
+        for ext in ('.json', '.frames', '.rows'):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+
+    def evict(self, max_bytes=None, keep=()):
+        '''Removes the least recently used entries until the cache holds max_bytes; returns their keys'''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(entry['size'] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if entry['key'] in keep:
+                continue
+            self.remove(entry['key'])
+            total -= entry['size']
+            removed.append(entry['key'])
+        return removed
+
+    def purge(self, keys=None, older_than=None):
+        '''
+        Removes the entries whose key starts with one of keys and/or that were not used for older_than seconds,
+        every entry if both are None; returns the removed keys
+        '''
+        now = time.time()
+        removed = []
+        for entry in self.entries():
+            if keys is not None and not any(entry['key'].startswith(k) for k in keys):
+                continue
+            if older_than is not None and now - entry['last_used'] < older_than:
+                continue
+            self.remove(entry['key'])
+            removed.append(entry['key'])
+        # Temporary files left by interrupted runs
+        if keys is None:
+            for tmp in glob.glob(os.path.join(self.directory, '*.tmp*')):
+                if now - os.path.getmtime(tmp) >= (older_than or 0):
+                    os.remove(tmp)
+        return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python3 -m demoTools.infercache',
+                                     description="Inspects and purges the cache of the network outputs")
+    parser.add_argument('-d', '--directory', default=default_directory(), help="Cache directory, $INFER_CACHE_DIR by default")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('list', help="List the entries, least recently used first")
+    purge = commands.add_parser('purge', help="Remove entries")
+    purge.add_argument('keys', nargs='*', help="Keys (or key prefixes) of the entries to remove")
+    purge.add_argument('--older_than', type=float, default=None, help="Remove the entries not used for this many days")
+    purge.add_argument('--max_mb', type=float, default=None, help="Remove the least recently used entries down to this size")
+    purge.add_argument('--all', action='store_true', help="Remove every entry")
+    args = parser.parse_args(argv)
+    if not args.directory:
+        parser.error("no cache directory, use -d or set INFER_CACHE_DIR")
+    cache = InferCache(args.directory)
+
+    if args.command == 'purge':
+        if args.max_mb is not None:
+            removed = cache.evict(int(args.max_mb * (1 << 20)))
+        elif args.all or args.keys or args.older_than is not None:
+            removed = cache.purge(args.keys or None, None if args.older_than is None else args.older_than * 86400)
+        else:
+            parser.error("purge needs keys, --older_than, --max_mb or --all")
+        for key in removed:
+            print("Removed {}".format(key))
+        print("{} entries removed".format(len(removed)))
+        return
+
+    entries = cache.entries()
+    print('{:<14} {:>9} {:>7} {:<16} {:<8} {}'.format('key', 'size(MB)', 'frames', 'last used', 'device', 'video / model'))
+    for entry in entries:
+        print('{:<14} {:>9.1f} {:>7} {:<16} {:<8} {} / {}'.format(
+            entry['key'][:12], entry['size'] / (1 << 20), entry.get('frames', '?'),
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used'])), str(entry.get('device', '?')),
+            entry.get('video', '?'), entry.get('model', '?')))
+    print("{} entries, {:.1f} MB of {:.1f} MB".format(len(entries), sum(e['size'] for e in entries) / (1 << 20),
+                                                    cache.max_bytes / (1 << 20)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
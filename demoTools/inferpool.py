@@ -0,0 +1,135 @@
+'''
+Pool of asynchronous infer requests shared by the demos.
+
+The pool keeps every request of an ExecutableNetwork busy: a new input is
+started as soon as any request is free, finished requests are harvested in
+the order the device completes them, and their outputs are handed back in
+submission order (or in completion order with ordered=False).
+'''
+
+import collections
+import time
+
+# StatusCode values returned by InferRequest.wait()
+OK = 0
+RESULT_NOT_READY = -9
+
+# Requests created for "auto". The device only reports OPTIMAL_NUMBER_OF_INFER_REQUESTS
+# once a network is loaded, and loading it again with that count costs a second compilation
+AUTO_NUM_REQUESTS = {'CPU': 4, 'GPU': 4, 'MYRIAD': 4, 'HDDL': 8, 'FPGA': 5}
+
+
+class InferResult:
+    '''
+    Output of one submitted input.
+    det_time: seconds from submit() until the pool harvested the result; it includes the time
+    the request queued on the device behind the others and waited to be harvested, so it is an
+    upper bound of the device latency
+    '''
+
+    def __init__(self, tag, output, det_time, request_id):
+        self.tag = tag
+        self.output = output
+        self.det_time = det_time
+        self.request_id = request_id
+
+
+def load_network(plugin, net, num_requests):
+    '''
+    Loads net to the plugin with num_requests infer requests.
+    num_requests: a positive count or "auto" to use the count of AUTO_NUM_REQUESTS for the device
+    '''
+    if str(num_requests) != 'auto':
+        return plugin.load(network=net, num_requests=int(num_requests))
+    # HETERO:FPGA,CPU and MULTI:... are sized for their first device
+    device = plugin.device.split(':')[-1].split(',')[0]
+    return plugin.load(network=net, num_requests=AUTO_NUM_REQUESTS.get(device, 2))
+
+
+class InferRequestPool:
+    def __init__(self, exec_net, input_blob, out_blob, ordered=True):
+        self.exec_net = exec_net
+        self.input_blob = input_blob
+        self.out_blob = out_blob
+        self.ordered = ordered
+        # In sync mode every submit waits for its own result
+        self.sync = False
+        self.num_requests = len(exec_net.requests)
+        self.free = collections.deque(range(self.num_requests))
+        self.in_flight = collections.OrderedDict()  # request_id -> (seq, tag, start time)
+        self.finished = {}  # seq -> InferResult, in completion order
+        self.submitted = 0
+        self.emitted = 0
+
+    def next_input(self):
+        '''
+        Input blob of the request the next submit() starts, waiting for a request to be free.
+        Filling it in place and calling submit(None) saves copying the input into the request.
+        '''
+        if not self.free:
+            self._harvest(block=True)
+        return self.exec_net.requests[self.free[0]].inputs[self.input_blob]
+
+    def submit(self, in_frame, tag=None):
+        '''
+        Starts inference on in_frame and returns the list of results that became ready.
+        in_frame: the input data, or None if it was written in place into next_input()
+        tag: any object to hand back with the result (frame number, source stream, ...)
+        '''
+        if not self.free:
+            self._harvest(block=True)
+        request_id = self.free.popleft()
+        inputs = None if in_frame is None else {self.input_blob: in_frame}
+        self.exec_net.start_async(request_id=request_id, inputs=inputs)
+        self.in_flight[request_id] = (self.submitted, tag, time.time())
+        self.submitted += 1
+        if self.sync:
+            while self.in_flight:
+                self._harvest(block=True)
+        else:
+            self._harvest(block=False)
+        return self._ready()
+
+    def drain(self):
+        '''Waits for all requests in flight and returns their results.'''
+        while self.in_flight:
+            self._harvest(block=True)
+        return self._ready()
+
+    def _harvest(self, block):
+        requests = self.exec_net.requests
+        done = []
+        for request_id in self.in_flight:
+            status = requests[request_id].wait(0)
+            if status == OK:
+                done.append(request_id)
+            elif status != RESULT_NOT_READY:
+                raise RuntimeError("Infer request {} failed with status {}".format(request_id, status))
+        if not done and block:
+            # Nothing finished yet: block on the oldest request, it is normally the next one to complete
+            request_id = next(iter(self.in_flight))
+            status = requests[request_id].wait(-1)
+            if status != OK:
+                raise RuntimeError("Infer request {} failed with status {}".format(request_id, status))
+            done.append(request_id)
+        for request_id in done:
+            self._complete(request_id)
+
+    def _complete(self, request_id):
+        seq, tag, start = self.in_flight.pop(request_id)
+        # The request is reused right away, so keep a copy of its output
+        output = self.exec_net.requests[request_id].outputs[self.out_blob].copy()
+        self.finished[seq] = InferResult(tag, output, time.time() - start, request_id)
+        self.free.append(request_id)
+
+    def _ready(self):
+        if not self.ordered:
+            ready = list(self.finished.values())
+            self.emitted += len(ready)
+            self.finished.clear()
+            return ready
+        ready = []
+        while self.emitted in self.finished:
+            ready.append(self.finished.pop(self.emitted))
+            self.emitted += 1
+        return ready
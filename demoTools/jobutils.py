@@ -0,0 +1,49 @@
+'''
+Utilities of the inference jobs running on the compute nodes.
+
+The jobs report their progress and their results to the notebook through small
+files in the results directory. Writing them only needs the standard library,
+unlike the notebook side (demoutils.py) which uses IPython, ipywidgets and
+matplotlib, so the jobs import this module instead:
+
+    from demoTools.jobutils import progressUpdate, writeStats
+    from demoTools.metrics import Metrics
+'''
+
+import os
+
+
+def progressUpdate(file_name, time_diff, frame_count, video_len):
+    progress = round(100*(frame_count/video_len), 1)
+    remaining_time = round((time_diff/frame_count)*(video_len-frame_count), 1)
+    estimated_time = round((time_diff/frame_count)*video_len, 1)
+    # Written next to the progress file then renamed over it, readers never see a partial record
+    tmp_name = '{}.{}.tmp'.format(file_name, os.getpid())
+    with open(tmp_name, "w") as progress_file:
+        progress_file.write('{} {} {}\n'.format(progress, remaining_time, estimated_time))
+    os.replace(tmp_name, file_name)
+
+
+def readProgress(path):
+    '''
+	Reads a progress file: one line "progress remaining estimated" written by progressUpdate,
+	or the same values on three lines (older writers such as the C++ demos)
+	Returns the three values as strings, None while the file is missing or incomplete
+    '''
+    try:
+        with open(path, "r") as fh:
+            values = fh.read().split()
+    except OSError:
+        return None
+    if len(values) < 3:
+        return None
+    return values[:3]
+
+
+def writeStats(file_name, total_time, frame_count):
+    '''
+	Writes the stats file read by videoHTML and summaryPlot: processing time in seconds, then frame count
+    '''
+    with open(file_name, "w") as f:
+        f.write(str(round(total_time, 1))+'\n')
+        f.write(str(frame_count)+'\n')
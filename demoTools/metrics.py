@@ -0,0 +1,149 @@
+'''
+Per-stage timing of the demos.
+
+Every frame goes through some of the stages below. The time spent in a stage is
+recorded in a fixed-size histogram, so the overhead and the memory used stay
+constant whatever the length of the video:
+
+    decode       reading and decoding the frame
+    preprocess   resizing / converting the frame for the network or the detector
+    infer_wait   time the inference request of the frame was in flight
+    postprocess  parsing, filtering and counting the results
+    draw         drawing boxes, contours and text on the frame
+    encode       writing the frame to the output video
+
+    metrics = Metrics()
+    start = time.perf_counter()
+    ret, frame = cap.read()
+    metrics.record('decode', time.perf_counter() - start)
+    with metrics.measure('draw'):
+        cv2.putText(frame, ...)
+    metrics.write(os.path.join(output_dir, 'metrics.json'), frames=frame_count, total_s=total_time)
+
+The metrics file is JSON, or CSV with one line per stage when the path ends with .csv.
+load_metrics() reads both, summaryPlot() in demoutils.py plots them.
+'''
+
+import bisect
+import csv
+import json
+import threading
+import time
+
+STAGES = ('decode', 'preprocess', 'infer_wait', 'postprocess', 'draw', 'encode')
+
+# Upper bounds of the histogram buckets in seconds: 10 per decade from 10us to 100s
+BUCKETS = [10 ** (e / 10) for e in range(-50, 21)]
+
+CSV_FIELDS = ('stage', 'count', 'total_s', 'mean_ms', 'min_ms', 'max_ms', 'p50_ms', 'p90_ms', 'p99_ms')
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.bins = [0] * (len(BUCKETS) + 1)
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.bins[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, p):
+        '''Upper bound of the bucket holding the p-th percentile, never above the largest sample'''
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for idx, n in enumerate(self.bins):
+            seen += n
+            if n and seen >= rank:
+                return min(BUCKETS[idx] if idx < len(BUCKETS) else self.max, self.max)
+        return self.max
+
+    def as_dict(self):
+        count = max(self.count, 1)
+        return {'count': self.count,
+                'total_s': round(self.total, 4),
+                'mean_ms': round(1000 * self.total / count, 3),
+                'min_ms': round(1000 * (self.min or 0), 3),
+                'max_ms': round(1000 * self.max, 3),
+                'p50_ms': round(1000 * self.percentile(50), 3),
+                'p90_ms': round(1000 * self.percentile(90), 3),
+                'p99_ms': round(1000 * self.percentile(99), 3),
+                'buckets': {'{:.6g}'.format(BUCKETS[idx] if idx < len(BUCKETS) else float('inf')): n
+                            for idx, n in enumerate(self.bins) if n}}
+
+
+class _Measure:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    '''Histograms of the stage times; stages may be recorded from several threads'''
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.record(seconds)
+
+    def measure(self, stage):
+        '''Context manager recording the time spent in its block'''
+        return _Measure(self, stage)
+
+    def as_dict(self, **summary):
+        '''summary: job level values stored next to the stages, e.g. frames and total_s'''
+        frames = summary.get('frames')
+        total_s = summary.get('total_s')
+        if frames and total_s:
+            summary['fps'] = round(frames / total_s, 2)
+        # Known stages first, in pipeline order
+        names = [s for s in STAGES if s in self.histograms] + sorted(set(self.histograms) - set(STAGES))
+        with self.lock:
+            summary['stages'] = {name: self.histograms[name].as_dict() for name in names}
+        return summary
+
+    def write(self, path, **summary):
+        data = self.as_dict(**summary)
+        with open(path, 'w') as f:
+            if path.endswith('.csv'):
+                writer = csv.writer(f)
+                writer.writerow(CSV_FIELDS)
+                for name, stage in data['stages'].items():
+                    writer.writerow([name] + [stage[field] for field in CSV_FIELDS[1:]])
+            else:
+                json.dump(data, f, indent=2)
+
+
+def load_metrics(path):
+    '''Reads a metrics file written by Metrics.write; CSV files only hold the stages'''
+    with open(path) as f:
+        if not path.endswith('.csv'):
+            return json.load(f)
+        stages = {}
+        for row in csv.DictReader(f):
+            name = row.pop('stage')
+            stages[name] = {field: float(value) for field, value in row.items()}
+            stages[name]['count'] = int(stages[name]['count'])
+        return {'stages': stages}
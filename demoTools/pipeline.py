@@ -0,0 +1,171 @@
+'''
+Staged processing pipeline for the demos.
+
+Every stage runs on its own thread and passes its output to the next stage
+through a bounded queue. A slow stage makes the queue in front of it fill up
+and blocks the stages before it (back-pressure) instead of letting frames pile
+up in memory, while the other stages keep overlapping with it.
+
+    pipeline = Pipeline(frames(cap), [Stage('preprocess', preprocess),
+                                      Stage('infer', infer, flush=pool.drain),
+                                      Stage('write', write)])
+    pipeline.start()
+    pipeline.join()
+    print(pipeline.report())
+'''
+
+import queue
+import threading
+import time
+
+# Marks the end of the stream in the stage queues
+_END = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.max_latency = 0.0
+        self.depth_sum = 0
+        self.max_depth = 0
+
+    def record(self, latency, depth):
+        self.items += 1
+        self.busy += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+        self.depth_sum += depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def as_dict(self):
+        items = max(self.items, 1)
+        return {'stage': self.name,
+                'items': self.items,
+                'busy': round(self.busy, 3),
+                'mean_latency_ms': round(1000 * self.busy / items, 3),
+                'max_latency_ms': round(1000 * self.max_latency, 3),
+                'mean_queue_depth': round(self.depth_sum / items, 2),
+                'max_queue_depth': self.max_depth}
+
+
+class Stage:
+    '''
+    name: stage name used in the statistics
+    fn: called with every input item, returns an iterable of output items (or None)
+    flush: called once at the end of the stream, returns the remaining output items
+    '''
+    def __init__(self, name, fn, flush=None):
+        self.name = name
+        self.fn = fn
+        self.flush = flush
+
+
+class Pipeline:
+    def __init__(self, source, stages, maxsize=8, source_name='decode'):
+        '''
+        source: iterable producing the input items, consumed on its own thread
+        stages: list of Stage run in order; the output of the last stage is discarded
+        maxsize: capacity of every queue between two stages
+        '''
+        self.source = source
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in stages]
+        self.stats = [StageStats(source_name)] + [StageStats(s.name) for s in stages]
+        self.stopping = threading.Event()
+        self.error = None
+        self.threads = [threading.Thread(target=self._produce, name=source_name)]
+        for idx, stage in enumerate(stages):
+            self.threads.append(threading.Thread(target=self._consume, args=(idx,), name=stage.name))
+
+    def start(self):
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        '''Stops reading the source; items already read still go through every stage.'''
+        self.stopping.set()
+
+    def alive(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def join(self, timeout=None):
+        '''Waits for the pipeline to finish and re-raises the first error of a stage.'''
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.time()))
+        if self.error is not None and not self.alive():
+            raise self.error
+        return not self.alive()
+
+    def report(self):
+        lines = ["{:<12}{:>8}{:>10}{:>12}{:>12}{:>11}{:>11}".format(
+            'stage', 'items', 'busy s', 'mean ms', 'max ms', 'mean q', 'max q')]
+        for stats in self.stats:
+            d = stats.as_dict()
+            lines.append("{:<12}{:>8}{:>10}{:>12}{:>12}{:>11}{:>11}".format(
+                d['stage'], d['items'], d['busy'], d['mean_latency_ms'], d['max_latency_ms'],
+                d['mean_queue_depth'], d['max_queue_depth']))
+        return '\n'.join(lines)
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopping.set()
+
+    def _produce(self):
+        stats = self.stats[0]
+        out = self.queues[0]
+        try:
+            items = iter(self.source)
+            while not self.stopping.is_set():
+                start = time.time()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                stats.record(time.time() - start, 0)
+                out.put(item)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            out.put(_END)
+
+    def _consume(self, idx):
+        stage = self.stages[idx]
+        stats = self.stats[idx + 1]
+        inp = self.queues[idx]
+        out = self.queues[idx + 1] if idx + 1 < len(self.queues) else None
+        failed = False
+        while True:
+            depth = inp.qsize()
+            item = inp.get()
+            if item is _END:
+                break
+            if failed:
+                # Keep draining so the stages before this one never block on a full queue
+                continue
+            start = time.time()
+            try:
+                outputs = stage.fn(item)
+                stats.record(time.time() - start, depth)
+                # Time spent blocked on a full queue is back-pressure, not stage latency
+                if outputs is not None and out is not None:
+                    for output in outputs:
+                        out.put(output)
+            except Exception as e:
+                self._fail(e)
+                failed = True
+        if stage.flush is not None and not failed:
+            try:
+                outputs = stage.flush()
+                if outputs is not None and out is not None:
+                    for output in outputs:
+                        out.put(output)
+            except Exception as e:
+                self._fail(e)
+        if out is not None:
+            out.put(_END)
@@ -0,0 +1,67 @@
+'''
+Frame preprocessing for the network input without per-frame allocations.
+
+The usual path
+
+    in_frame = cv2.resize(frame, (w, h)).transpose((2, 0, 1)).reshape((n, c, h, w))
+
+allocates the resized image and a contiguous copy of its transposed view for
+every frame, and start_async() copies it once more into the request. The
+Preprocessor resizes into a scratch image it owns and splits its channels
+straight into the planes of a preallocated NCHW buffer: either one of its own
+ring of buffers, or the input blob of the infer request itself so that the
+request can be started without copying its inputs (InferRequestPool.next_input).
+
+    preprocess = Preprocessor((n, c, h, w), buffers=queue_size + 2)
+    in_frame = preprocess.fill(frame)               # next buffer of the ring
+    preprocess.fill(frame, pool.next_input(), b)    # in place, image b of the batch
+    pool.submit(None, tag)
+'''
+
+import cv2
+import numpy as np
+
+
+class Preprocessor:
+    def __init__(self, shape, buffers=1, dtype=np.uint8):
+        '''
+        shape: (n, c, h, w) input shape of the network
+        buffers: size of the ring of buffers handed out by fill() when no output is given; a buffer
+                 is reused after that many calls, so it must cover every input not yet submitted
+        dtype: precision of the ring buffers
+        '''
+        n, c, h, w = shape
+        self.shape = tuple(shape)
+        self.size = (w, h)
+        self.resized = np.empty((h, w, c), dtype=np.uint8)
+        self.planes = np.empty((c, h, w), dtype=np.uint8)
+        self.ring = [np.zeros(shape, dtype=dtype) for _ in range(buffers)]
+        self.next = 0
+
+    def next_buffer(self):
+        buffer = self.ring[self.next]
+        self.next = (self.next + 1) % len(self.ring)
+        return buffer
+
+    def fill(self, frame, out=None, index=0):
+        '''
+        Resizes a BGR frame into image index of the NCHW array out and returns out
+        out: any array of the input shape, e.g. the input blob of an infer request;
+             the next buffer of the ring by default
+        '''
+        if out is None:
+            out = self.next_buffer()
+        if frame.shape[1::-1] == self.size:
+            resized = frame
+        else:
+            resized = cv2.resize(frame, self.size, dst=self.resized)
+        planes = out[index]
+        if planes.dtype == np.uint8 and planes[0].flags.c_contiguous:
+            # Every plane is a contiguous view into out, cv2.split writes the channels in place
+            cv2.split(resized, list(planes))
+        else:
+            # Other precisions (e.g. FP32 blobs): split first, a contiguous converting copy is
+            # much cheaper than converting the strided transposed view
+            cv2.split(resized, list(self.planes))
+            np.copyto(planes, self.planes, casting='unsafe')
+        return out
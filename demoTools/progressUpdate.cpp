@@ -13,19 +13,23 @@
 #include <vector>
 #include <algorithm> 
 #include <assert.h>
+#include <cstdio>
 
 using namespace std;
 using namespace cv;
 
 void progressUpdate(string file_name, double time_diff, int frame_count, int video_len){
 
+	//Written next to the progress file then renamed over it, readers never see a partial record
+	string tmp_name = file_name+".tmp";
 	ofstream progress;
-	progress.open(file_name);
+	progress.open(tmp_name);
 	double cur_progress = 100*frame_count/video_len;
 	double remaining_time = (time_diff/frame_count)*(video_len-frame_count);
 	double  estimated_time = (time_diff/frame_count)*video_len;
-	progress<<setprecision(1)<<fixed<<cur_progress<<'\n';
-	progress<<setprecision(1)<<fixed<<remaining_time<<'\n';
+	progress<<setprecision(1)<<fixed<<cur_progress<<' ';
+	progress<<setprecision(1)<<fixed<<remaining_time<<' ';
 	progress<<setprecision(1)<<fixed<<estimated_time<<'\n';
 	progress.close();
+	rename(tmp_name.c_str(), file_name.c_str());
 }
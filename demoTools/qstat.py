@@ -0,0 +1,202 @@
+'''
+Shared view of the job queue.
+
+Every open widget used to fork qstat every second. A single QstatPoller per
+process runs the command instead and caches the parsed jobs for ttl seconds,
+so that any number of widgets, progress bars or cells share the same result:
+
+    poller = qstat_poller()
+    jobs = poller.jobs()                 # {job id: QstatJob}, at most ttl seconds old
+    poller.subscribe(on_change)          # on_change(QstatDiff) whenever a job is added, changes or leaves
+    poller.unsubscribe(on_change)
+
+While someone is subscribed, a background thread polls the queue. It polls
+every min_interval seconds while jobs change, and backs off up to
+max_interval seconds while nothing changes or qstat fails. poke() makes it
+poll right away, e.g. after a qsub.
+
+The command is injectable, so the poller can be tested with a fake qstat script:
+
+    poller = QstatPoller(cmd=['python3', 'fake_qstat.py'])
+'''
+
+import collections
+import subprocess
+import threading
+import time
+
+QSTAT_TTL = 1.0
+QSTAT_MIN_INTERVAL = 1.0
+QSTAT_MAX_INTERVAL = 10.0
+QSTAT_BACKOFF = 2.0
+
+QstatJob = collections.namedtuple('QstatJob', ['id', 'name', 'user', 'time_use', 'state', 'queue'])
+
+# Jobs added, changed as {id: (old, new)} and removed since the previous poll, and all the current jobs
+QstatDiff = collections.namedtuple('QstatDiff', ['added', 'changed', 'removed', 'jobs'])
+
+
+def parse_qstat(output):
+    '''
+    Parses the default output of qstat:
+
+        Job ID                    Name             User            Time Use S Queue
+        ------------------------- ---------------- --------------- -------- - -----
+        12345.c009                obj_det_core     u12345          00:00:05 R batch
+
+    Returns {job id: QstatJob} in the order of the output
+    '''
+    jobs = collections.OrderedDict()
+    in_table = False
+    for line in output.splitlines():
+        if line.startswith('---'):
+            in_table = True
+            continue
+        fields = line.split()
+        if not in_table or len(fields) < 6:
+            continue
+        job = QstatJob(fields[0], fields[1], fields[2], fields[3], fields[4], ' '.join(fields[5:]))
+        jobs[job.id] = job
+    return jobs
+
+
+def diff_jobs(old, new):
+    added = collections.OrderedDict((i, job) for i, job in new.items() if i not in old)
+    changed = collections.OrderedDict((i, (old[i], job)) for i, job in new.items() if i in old and old[i] != job)
+    removed = collections.OrderedDict((i, job) for i, job in old.items() if i not in new)
+    return QstatDiff(added, changed, removed, new)
+
+
+class QstatPoller:
+    def __init__(self, cmd=('qstat',), ttl=QSTAT_TTL, min_interval=QSTAT_MIN_INTERVAL,
+                 max_interval=QSTAT_MAX_INTERVAL, backoff=QSTAT_BACKOFF):
+        '''
+        cmd: command printing the queue, qstat by default
+        ttl: seconds the parsed jobs are served from the cache
+        min_interval, max_interval: bounds of the time between two polls of the background thread
+        backoff: factor growing the time between two polls while nothing changes
+        '''
+        self.cmd = list(cmd)
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.cache = collections.OrderedDict()
+        self.updated = None
+        self.error = None
+        self.polls = 0
+        # lock guards the state; poll_lock lets one command run at a time, without blocking the readers of
+        # the state, so that callers arriving during a poll wait for its result instead of forking again
+        self.lock = threading.Lock()
+        self.poll_lock = threading.RLock()
+        self.subscribers = []
+        self.wake = threading.Event()
+        self.thread = None
+
+    def _run_cmd(self):
+        p = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, err = p.communicate()
+        if p.returncode:
+            raise RuntimeError('{} failed: {}'.format(' '.join(self.cmd), err.decode().strip()))
+        return output.decode()
+
+    def _fresh(self, max_age):
+        with self.lock:
+            return self.updated is not None and time.monotonic() - self.updated <= max_age
+
+    def refresh(self, max_age=None):
+        '''
+        Runs the command now and notifies the subscribers if the jobs changed; returns the QstatDiff
+        max_age: skip the command if the jobs were polled less than max_age seconds ago, e.g. by
+                 the poll another caller was waiting for
+        '''
+        with self.poll_lock:
+            if max_age is not None and self._fresh(max_age):
+                with self.lock:
+                    return diff_jobs(self.cache, self.cache)
+            with self.lock:
+                self.polls += 1
+            try:
+                jobs, error = parse_qstat(self._run_cmd()), None
+            except Exception as e:
+                # Keep serving the last known jobs
+                jobs, error = None, e
+            with self.lock:
+                self.error = error
+                if jobs is None:
+                    jobs = self.cache
+                diff = diff_jobs(self.cache, jobs)
+                self.cache = jobs
+                self.updated = time.monotonic()
+                subscribers = list(self.subscribers)
+            # Still under poll_lock, so the subscribers get the diffs in order
+            if diff.added or diff.changed or diff.removed:
+                for callback in subscribers:
+                    callback(diff)
+            return diff
+
+    def jobs(self, max_age=None):
+        '''Jobs of the queue, polled again if the cache is older than max_age (ttl by default)'''
+        max_age = self.ttl if max_age is None else max_age
+        if not self._fresh(max_age):
+            self.refresh(max_age)
+        with self.lock:
+            return self.cache
+
+    def subscribe(self, callback):
+        '''callback(QstatDiff) is called from the poller thread with every change of the queue'''
+        # Under poll_lock no poll can notify the new subscriber before it got the known jobs
+        with self.poll_lock:
+            with self.lock:
+                self.subscribers.append(callback)
+                # New subscribers get the known jobs as added, the poller only reports changes
+                known = None if self.updated is None else diff_jobs({}, self.cache)
+                running = self.thread is not None
+                if not running:
+                    self.thread = threading.Thread(target=self._run, name='qstat')
+                    self.thread.daemon = True
+                    self.thread.start()
+            if known is not None:
+                callback(known)
+        if running:
+            self.poke()
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+        self.wake.set()
+
+    def poke(self):
+        '''Polls right away, e.g. after submitting a job'''
+        self.interval = self.min_interval
+        self.wake.set()
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    # Restarted by the next subscribe()
+                    self.thread = None
+                    return
+            self.wake.clear()
+            diff = self.refresh()
+            if diff.added or diff.changed or diff.removed:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+            self.wake.wait(self.interval)
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def qstat_poller():
+    '''The QstatPoller shared by the whole process'''
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = QstatPoller()
+        return _poller
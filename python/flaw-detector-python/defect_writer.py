@@ -0,0 +1,116 @@
+'''
+Saves the crops of the inspected objects off the frame loop.
+
+The checks of the flaw detector hand their crops to a DefectWriter, whose
+threads encode them and write them to disk. The queue is bounded, so when the
+disk cannot keep up (e.g. a job directory on NFS) the frame loop waits for room
+instead of piling up crops in memory.
+
+    writer = DefectWriter(base_dir, image_format='jpg', quality=90)
+    writer.write('crack', 'Crack_{}'.format(count_object), crop)
+    writer.close()
+
+By default every crop is its own file, <base_dir>/<category>/<name>.<format>.
+With archive=True the crops of a category are appended to a single
+<base_dir>/<category>/<category>.zip instead. The entries are stored
+uncompressed, since the images already are, and the zip central directory
+indexes them:
+
+    with zipfile.ZipFile('crack/crack.zip') as archive:
+        crop = cv2.imdecode(np.frombuffer(archive.read('Crack_12.jpg'), np.uint8), cv2.IMREAD_COLOR)
+'''
+
+import os
+import queue
+import threading
+import time
+import zipfile
+
+import cv2
+
+FORMATS = {'jpg': cv2.IMWRITE_JPEG_QUALITY, 'png': None, 'webp': cv2.IMWRITE_WEBP_QUALITY}
+WRITER_QUEUE_SIZE = 64
+
+
+class DefectWriter:
+    def __init__(self, base_dir, image_format='jpg', quality=95, workers=1, archive=False,
+                 maxsize=WRITER_QUEUE_SIZE, metrics=None):
+        """
+        :param base_dir: directory holding one directory per category
+        :param image_format: 'jpg', 'png' or 'webp'
+        :param quality: 0-100 quality of the jpg and webp encoders, png is lossless
+        :param workers: threads encoding and writing the crops
+        :param archive: append the crops of a category to <category>/<category>.zip instead of one file per crop
+        :param maxsize: crops waiting to be written before write() blocks
+        :param metrics: Metrics recording the time spent saving every crop as the 'save' stage
+        """
+        if image_format not in FORMATS:
+            raise ValueError("Unsupported image format {}, use one of {}".format(image_format, ', '.join(FORMATS)))
+        self.base_dir = base_dir
+        self.ext = '.' + image_format
+        self.params = [] if FORMATS[image_format] is None else [FORMATS[image_format], int(quality)]
+        self.archive = archive
+        self.archives = {}
+        self.archive_lock = threading.Lock()
+        self.metrics = metrics
+        self.error = None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.threads = [threading.Thread(target=self._run, name='defect-writer-{}'.format(i)) for i in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def write(self, category, name, image):
+        """
+        Queues a crop, blocking while the queue is full, and raises the error of an earlier crop
+        right away instead of dropping the crops that follow it
+        :param category: directory of the crop, e.g. 'crack'
+        :param name: file name of the crop without extension
+        :param image: crop to save; it is copied, the caller may keep drawing on the frame
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((category, name, image.copy()))
+
+    def close(self):
+        """Waits for the queued crops to be written, closes the archives and re-raises the first error"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        for archive in self.archives.values():
+            archive.close()
+        self.archives = {}
+        if self.error is not None:
+            raise self.error
+
+    def _save(self, category, name, image):
+        start = time.perf_counter()
+        ok, data = cv2.imencode(self.ext, image, self.params)
+        if not ok:
+            raise IOError("Could not encode {}{}".format(name, self.ext))
+        if self.archive:
+            with self.archive_lock:
+                archive = self.archives.get(category)
+                if archive is None:
+                    path = os.path.join(self.base_dir, category, category + '.zip')
+                    archive = self.archives[category] = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+                archive.writestr(name + self.ext, data.tobytes())
+        else:
+            with open(os.path.join(self.base_dir, category, name + self.ext), 'wb') as f:
+                f.write(data.tobytes())
+        if self.metrics is not None:
+            self.metrics.record('save', time.perf_counter() - start)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # Keep draining so the frame loop never blocks on a full queue
+                continue
+            try:
+                self._save(*item)
+            except Exception as e:
+                self.error = e
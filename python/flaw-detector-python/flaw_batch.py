@@ -0,0 +1,198 @@
+'''
+Runs the flaw detector on many videos across a pool of processes.
+
+    python3 flaw_batch.py -i /data/line1/2018-10-17/ -o results/ -p 4 --cpus 0-3 --pin --headless
+    python3 flaw_batch.py -i manifest.txt -o results/
+
+The input is a directory, whose videos are all inspected, or a manifest file
+listing one video per line (blank lines and lines starting with # are
+skipped). Every video is inspected by runFlawDetector in one of the worker
+processes, into its own output directory <output>/<video name>/ holding the
+usual crop directories, defect_report.json, metrics.json and the log of the
+run. The summaries of all the videos are merged into <output>/batch_report.json.
+
+--cpus restricts the workers to a set of CPUs, --pin binds each worker to
+one of them so that the workers do not migrate between cores.
+'''
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import Counter
+
+from flawdetector import runFlawDetector
+from defect_writer import FORMATS
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.m4v', '.h264', '.264')
+
+
+def parse_cpus(spec):
+    """
+    :param spec: CPUs as a list of numbers and ranges, e.g. '0-3,6'
+    :return: sorted list of the CPUs
+    """
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def list_videos(source):
+    """
+    :param source: directory of videos or manifest file with one video per line
+    :return: paths of the videos, in name or manifest order
+    """
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source))
+                if name.lower().endswith(VIDEO_EXTENSIONS)]
+    videos = []
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                videos.append(os.path.normpath(os.path.join(base, line)))
+    return videos
+
+
+def output_dirs(videos, output):
+    """One output directory per video named after it, numbered when several videos have the same name"""
+    seen = Counter()
+    dirs = []
+    for video in videos:
+        name = os.path.splitext(os.path.basename(video))[0]
+        seen[name] += 1
+        dirs.append(os.path.join(output, name if seen[name] == 1 else '{}_{}'.format(name, seen[name])))
+    return dirs
+
+
+def init_worker(cpu_sets):
+    """Pool initializer: binds the worker to the next CPU set of the queue"""
+    if cpu_sets is None:
+        return
+    cpus = cpu_sets.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+
+def inspect_video(job):
+    """
+    Runs the flaw detector on one video in a worker process, its output going to <out_dir>/log.txt
+    :param job: (index, video, out_dir, options of runFlawDetector)
+    :return: index and summary of the video
+    """
+    index, video, out_dir, options = job
+    os.makedirs(out_dir, exist_ok=True)
+    summary = {'video': video, 'output': out_dir, 'pid': os.getpid()}
+    start = time.time()
+    with open(os.path.join(out_dir, 'log.txt'), 'w') as log:
+        try:
+            with contextlib.redirect_stdout(log):
+                runFlawDetector(video, out_dir, **options)
+        except Exception:
+            traceback.print_exc(file=log)
+            summary['error'] = traceback.format_exc().strip().splitlines()[-1]
+    summary['seconds'] = round(time.time() - start, 3)
+    report_path = os.path.join(out_dir, 'defect_report.json')
+    if os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+        clean = sum(1 for obj in report['objects'] if obj['defects'] == ["No Defect"])
+        # Objects by type of defect, the objects without defect are only counted as clean
+        defects = Counter(d for obj in report['objects'] for d in obj['defects'] if d != "No Defect")
+        summary.update(frames=report['frames'], objects=len(report['objects']),
+                       defective=len(report['objects']) - clean, clean=clean, defects=dict(defects))
+        if not report['frames'] and 'error' not in summary:
+            summary['error'] = "Could not read {}".format(video)
+    return index, summary
+
+
+def merge_summaries(summaries, seconds):
+    """Totals of all the videos next to their summaries"""
+    defects = Counter()
+    for summary in summaries:
+        defects.update(summary.get('defects', {}))
+    return {'videos': len(summaries),
+            'failed': sum(1 for summary in summaries if 'error' in summary),
+            'frames': sum(summary.get('frames', 0) for summary in summaries),
+            'objects': sum(summary.get('objects', 0) for summary in summaries),
+            'defective': sum(summary.get('defective', 0) for summary in summaries),
+            'clean': sum(summary.get('clean', 0) for summary in summaries),
+            'defects': dict(defects),
+            'seconds': round(seconds, 3),
+            'summaries': summaries}
+
+
+def runBatch(videos, output, processes=None, cpus=None, pin=False, **options):
+    """
+    :param videos: paths of the videos to inspect
+    :param output: directory holding one output directory per video and batch_report.json
+    :param processes: worker processes, one per CPU allowed by cpus by default
+    :param cpus: list of CPUs the workers may run on, all of them by default
+    :param pin: bind each worker to a single CPU of cpus (round-robin when there are more workers than CPUs)
+    :param options: options of runFlawDetector, e.g. headless=True
+    :return: the merged report
+    """
+    if cpus is None and hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    processes = processes or (len(cpus) if cpus else os.cpu_count()) or 1
+    processes = max(min(processes, len(videos)), 1)
+    cpu_sets = None
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        cpu_sets = multiprocessing.Queue()
+        for i in range(processes):
+            cpu_sets.put({cpus[i % len(cpus)]} if pin else set(cpus))
+    # One thread per video by default, the parallelism comes from the processes
+    options.setdefault('workers', 1)
+
+    os.makedirs(output, exist_ok=True)
+    jobs = [(i, video, out_dir, options) for i, (video, out_dir) in enumerate(zip(videos, output_dirs(videos, output)))]
+    summaries = [None] * len(jobs)
+    start = time.time()
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(cpu_sets,)) as pool:
+        for done, (index, summary) in enumerate(pool.imap_unordered(inspect_video, jobs), 1):
+            summaries[index] = summary
+            status = summary['error'] if 'error' in summary else '{} objects, {} defective'.format(
+                summary.get('objects', 0), summary.get('defective', 0))
+            print("[{}/{}] {}: {} ({}s)".format(done, len(jobs), summary['video'], status, summary['seconds']))
+    report = merge_summaries(summaries, time.time() - start)
+    with open(os.path.join(output, 'batch_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', required=True, help="Directory of videos or manifest file with one video per line")
+    parser.add_argument('-o', '--output', required=True, help="Directory of the output directories of the videos and of batch_report.json")
+    parser.add_argument('-p', '--processes', default=None, type=int, help="Worker processes, one per allowed CPU by default")
+    parser.add_argument('-c', '--cpus', default=None, help="CPUs the workers may run on, e.g. 0-3,6")
+    parser.add_argument('--pin', action='store_true', help="Bind every worker to a single CPU")
+    parser.add_argument('-w', '--workers', default=1, type=int, help="Threads checking the objects of a frame in every process")
+    parser.add_argument('-hl', '--headless', action='store_true', help="Only save the crops and the defect reports, without output videos")
+    parser.add_argument('-sm', '--sampling', default='fixed', choices=['fixed', 'motion'], help="Sampling of the frames, see flawdetector.py")
+    parser.add_argument('-fn', '--frame_number', default=40, type=int, help="Frames between two inspections with fixed sampling")
+    parser.add_argument('-if', '--image_format', default='jpg', choices=sorted(FORMATS), help="Format of the saved crops")
+    parser.add_argument('-q', '--quality', default=95, type=int, help="Quality (0-100) of the jpg and webp crops")
+    parser.add_argument('-a', '--archive', action='store_true', help="Append the crops of each category to a single zip file")
+    args = parser.parse_args()
+
+    videos = list_videos(args.input)
+    if not videos:
+        sys.exit("No video found in {}".format(args.input))
+    report = runBatch(videos, args.output, args.processes, parse_cpus(args.cpus) if args.cpus else None, args.pin,
+                      workers=args.workers, headless=args.headless, sampling=args.sampling,
+                      frame_number=args.frame_number, image_format=args.image_format, quality=args.quality,
+                      archive=args.archive)
+    print("{} videos, {} failed, {} objects, {} defective in {}s".format(
+        report['videos'], report['failed'], report['objects'], report['defective'], report['seconds']))
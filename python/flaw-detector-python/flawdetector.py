@@ -25,15 +25,29 @@
 
 import cv2
 import argparse
+import json
 import socket
 import os
+import sys
+import time
 
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from math import atan2
+from pathlib import Path
+sys.path.insert(0, str(Path().resolve().parent.parent))
+from demoTools.metrics import Metrics
+from defect_writer import DefectWriter, FORMATS
+from sampling import FixedSampler, MotionSampler
 
 # Lower and upper value of color Range of the object for color thresholding to detect the object
 
+# Pixels around the bounding box of an object included in the area its color and crack checks work on;
+# covers the crops of the defect images and the kernels of the filters
+ROI_PADDING = 20
+
 
 
 '''
@@ -46,29 +60,51 @@ from math import atan2
 '''
 
 
+def save_crop(base_dir, category, name, image, writer=None):
+    """
+    Saves the crop of an object in the directory of its category
+    :param image: crop of the object; its top left corner is clipped to the image by the callers, a negative
+                  start would wrap around and give an empty crop for objects at the left or top edge
+    :param writer: DefectWriter saving the crop in the background, written right away as jpg by default
+    """
+    if writer is None:
+        cv2.imwrite("{}/{}/{}.jpg".format(base_dir, category, name), image)
+    else:
+        writer.write(category, name, image)
+
+
+def log(messages, message):
+    """
+    Prints a message of a check, or keeps it in messages to be printed in object order later
+    :param messages: list collecting the messages of an object checked on a pool thread, None to print
+    """
+    if messages is None:
+        print(message)
+    else:
+        messages.append(message)
+
+
 def get_orientation(contours):
     """
     Gives the angle of the orientation of the object in radians
     :param contours: contour of the object from the frame
     :return: angle of orientation of the object in radians
     """
-    size_points = len(contours)
     # data_pts stores contour values in 2D
-    data_pts = np.empty((size_points, 2), dtype=np.float64)
-    for i in range(data_pts.shape[0]):
-        data_pts[i, 0] = contours[i, 0, 0]
-        data_pts[i, 1] = contours[i, 0, 1]
+    data_pts = contours.reshape(-1, 2).astype(np.float64)
     # Use PCA algorithm to find angle of the data points
     mean, eigenvector = cv2.PCACompute(data_pts, mean=None)
     angle = atan2(eigenvector[0, 1], eigenvector[0, 0])
     return angle
 
 
-def detect_orientation(frame, contours, base_dir, count_object):
+def detect_orientation(frame, contours, base_dir, count_object, writer=None, messages=None):
     """
     Identifies the Orientation of the object based on the detected angle
     :param frame: Input frame from video
     :param contours: contour of the object from the frame
+    :param writer: DefectWriter saving the crop of a defective object, see save_crop
+    :param messages: list collecting the printed messages, see log
     :return: defect_flag, object_defect
     """
     object_defect = "Defect : Orientation"
@@ -79,9 +115,9 @@ def detect_orientation(frame, contours, base_dir, count_object):
         defect_flag = False
     else:
         x, y, w, h = cv2.boundingRect(contours)
-        print("Orientation defect detected in object {}".format(count_object))
+        log(messages, "Orientation defect detected in object {}".format(count_object))
         defect_flag = True
-        cv2.imwrite("{}/orientation/Orientation_{}.jpg".format(base_dir, count_object), frame[y - 5: y + h + 10, x - 5: x + w + 10])
+        save_crop(base_dir, "orientation", "Orientation_{}".format(count_object), frame[max(y - 5, 0): y + h + 10, max(x - 5, 0): x + w + 10], writer)
     return defect_flag, object_defect
 
 
@@ -100,12 +136,15 @@ def detect_orientation(frame, contours, base_dir, count_object):
 '''
 
 
-def detect_color(frame, cnt, base_dir, count_object):
+def detect_color(frame, cnt, base_dir, count_object, img_hsv=None, writer=None, messages=None):
     """
     Identifies the color defect W.R.T the set default color of the object
     :param frame: Input frame from the video
     :param cnt: Contours of the object
-    :return: color_flag, object_defect
+    :param img_hsv: HSV conversion of the brightened frame if already computed
+    :param writer: DefectWriter saving the crop of a defective object, see save_crop
+    :param messages: list collecting the printed messages, see log
+    :return: color_flag, object_defect, contours of the defective areas drawn on the frame
     """
     LOWER_COLOR_RANGE = (0, 0, 0)
     UPPER_COLOR_RANGE = (174, 73, 255)
@@ -115,24 +154,27 @@ def detect_color(frame, cnt, base_dir, count_object):
     # Increase the brightness of the image
     cv2.convertScaleAbs(frame, frame, 1, 20)
     # Convert the captured frame from BGR to HSV
-    img_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    if img_hsv is None:
+        img_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
     # Threshold the image
     img_thresholded = cv2.inRange(img_hsv, LOWER_COLOR_RANGE, UPPER_COLOR_RANGE)
     # Morphological opening (remove small objects from the foreground)
     img_thresholded = cv2.erode(img_thresholded, kernel=cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
     img_thresholded = cv2.dilate(img_thresholded, kernel=cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
     contours, hierarchy = cv2.findContours(img_thresholded, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    defect_contours = []
     for i in range(len(contours)):
         area = cv2.contourArea(contours[i])
         if 2000 < area < 10000:
             cv2.drawContours(frame, contours[i], -1, (0, 0, 255), 2)
+            defect_contours.append(contours[i])
             color_flag = True
     if color_flag == True:
         x,y,w,h =cv2.boundingRect(cnt)
-        print("Color defect detected in object {}".format(count_object))
-        print("{}/color/Color_{}.jpg".format(base_dir, count_object))
-        cv2.imwrite("{}/color/Color_{}.jpg".format(base_dir, count_object), frame[y - 5: y + h + 10, x - 5: x + w + 10])
-    return color_flag, object_defect
+        log(messages, "Color defect detected in object {}".format(count_object))
+        log(messages, "{}/color/Color_{}.jpg".format(base_dir, count_object))
+        save_crop(base_dir, "color", "Color_{}".format(count_object), frame[max(y - 5, 0): y + h + 10, max(x - 5, 0): x + w + 10], writer)
+    return color_flag, object_defect, defect_contours
 
 
 '''
@@ -147,11 +189,14 @@ def detect_color(frame, cnt, base_dir, count_object):
 '''
 
 
-def detect_crack(frame, cnt, base_dir, count_object):
+def detect_crack(frame, cnt, base_dir, count_object, img_gray=None, writer=None, messages=None):
     """
     Identifies the Crack defect on the object
     :param frame: Input frame from the video
     :param cnt: Contours of the object
+    :param img_gray: blurred gray conversion of the frame if already computed
+    :param writer: DefectWriter saving the crop of a defective object, see save_crop
+    :param messages: list collecting the printed messages, see log
     :return: defect_flag, object_defect, cnt
     """
     object_defect = "Defect : Crack"
@@ -160,8 +205,11 @@ def detect_crack(frame, cnt, base_dir, count_object):
     kernel_size = 3
     ratio = 3
     # Convert the captured frame from BGR to GRAY
-    img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    img = cv2.blur(img, (7, 7))
+    if img_gray is None:
+        img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        img = cv2.blur(img, (7, 7))
+    else:
+        img = img_gray
     # Find the edges
     detected_edges = cv2.Canny(img, low_threshold, low_threshold * ratio, kernel_size)
     # Find the contours
@@ -178,13 +226,89 @@ def detect_crack(frame, cnt, base_dir, count_object):
 
         if defect_flag == True:
             x, y, w, h = cv2.boundingRect(cnt)
-            cv2.imwrite("{}/crack/Crack_{}.jpg".format(base_dir, count_object), frame[y - 5: y + h + 20, x - 5: x + w + 10])
-            print("Crack defect detected in object {}".format(count_object))
+            save_crop(base_dir, "crack", "Crack_{}".format(count_object), frame[max(y - 5, 0): y + h + 20, max(x - 5, 0): x + w + 10], writer)
+            log(messages, "Crack defect detected in object {}".format(count_object))
     return defect_flag, object_defect, cnt
 
 
 
-def runFlawDetector(vid_path = 0, base_dir=None, draw_callback = None):
+def shared_conversions(frame):
+    """
+    Conversions of the whole frame used by the color and crack checks, computed once for all the objects
+    :return: HSV conversion of the brightened frame, blurred gray conversion of the frame
+    """
+    img_hsv = cv2.cvtColor(cv2.convertScaleAbs(frame, None, 1, 20), cv2.COLOR_BGR2HSV)
+    img_gray = cv2.blur(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (7, 7))
+    return img_hsv, img_gray
+
+
+def inspect_object(frame, cnt, base_dir, count_object, conversions=None, writer=None):
+    """
+    Runs the orientation, color and crack checks of one object on its own copy of the area around it
+    (ROI_PADDING pixels around its bounding box), so that the objects of a frame can be checked
+    concurrently and every check only processes the object
+    :param frame: Input frame from the video, left untouched
+    :param cnt: Contours of the object
+    :param conversions: shared_conversions of the frame, the checks convert their area themselves by default
+    :param writer: DefectWriter saving the crops of the defects
+    :return: defects found, contours drawn by the color check, crack contour (None without crack),
+             copy of the area with the drawings of the checks and its top left corner in the frame,
+             messages of the checks to print in object order; contours are in frame coordinates
+    """
+    x, y, w, h = cv2.boundingRect(cnt)
+    x0, y0 = max(x - ROI_PADDING, 0), max(y - ROI_PADDING, 0)
+    x1, y1 = min(x + w + ROI_PADDING, frame.shape[1]), min(y + h + ROI_PADDING, frame.shape[0])
+    checked = frame[y0:y1, x0:x1].copy()
+    frame_copy = checked.copy()
+    # The checks work in the coordinates of the area
+    roi_cnt = cnt - (x0, y0)
+    img_hsv, img_gray = (None, None) if conversions is None else (c[y0:y1, x0:x1] for c in conversions)
+    defect = []
+    messages = []
+
+    # Check for the orientation of the object
+    orientation_flag, orientation_defect = detect_orientation(checked, roi_cnt, base_dir, count_object, writer, messages)
+    if orientation_flag == True:
+        defect.append(str(orientation_defect))
+
+    # Check for the color defect of the object
+    color_flag, color_defect, color_contours = detect_color(checked, roi_cnt, base_dir, count_object, img_hsv, writer, messages)
+    if color_flag == True:
+        defect.append(str(color_defect))
+
+    # Check for the crack defect of the object
+    crack_flag, crack_defect, crack_contour = detect_crack(frame_copy, roi_cnt, base_dir, count_object, img_gray, writer, messages)
+    if crack_flag == True:
+        defect.append(str(crack_defect))
+        cv2.drawContours(checked, crack_contour, -1, (0, 255, 0), 2)
+        crack_contour = cnt
+    else:
+        crack_contour = None
+    # Translate the contours back to the frame
+    color_contours = [c + (x0, y0) for c in color_contours]
+    return defect, color_contours, crack_contour, checked, (x0, y0), messages
+
+
+def runFlawDetector(vid_path = 0, base_dir=None, draw_callback = None, workers=None, share_conversions=False,
+                    image_format='jpg', quality=95, writer_workers=1, archive=False,
+                    sampling='fixed', frame_number=40, trigger_zone=(0.25, 0.0, 0.75, 1.0), headless=False,
+                    callback_every=1):
+    """
+    :param workers: threads checking the objects of a sampled frame concurrently, one per core by default
+    :param share_conversions: compute the HSV and gray conversions of a sampled frame once for all its objects
+                              instead of converting the area of every object, faster with many objects
+    :param image_format: format of the saved crops, 'jpg', 'png' or 'webp'
+    :param quality: 0-100 quality of the jpg and webp crops
+    :param writer_workers: threads saving the crops in the background
+    :param archive: append the crops of each category to <category>/<category>.zip instead of one file per crop
+    :param sampling: 'fixed' inspects every object of every frame_number-th frame, 'motion' tracks the objects
+                     on every frame and inspects each one once, when it enters the trigger zone
+    :param frame_number: frames between two inspections with fixed sampling
+    :param trigger_zone: (x0, y0, x1, y1) in fractions of the frame, see sampling.MotionSampler
+    :param headless: only write the crops and defect_report.json, without annotating, displaying or encoding
+                     the frames; the frames the sampler does not need are not even decoded
+    :param callback_every: pass every callback_every-th output frame to draw_callback
+    """
 
     OBJECT_AREA = 9000
     LOW_H = 0
@@ -203,8 +327,9 @@ def runFlawDetector(vid_path = 0, base_dir=None, draw_callback = None):
     dir_names = ["crack", "color", "orientation", "no_defect"]
     frame_count = 0
     num_of_dir = 4
-    frame_number = 40
     defect = []
+    # Defects of every inspected object, written to defect_report.json
+    report = []
 
     # create folders with the given dir_names to save defective objects
     for i in range(len(dir_names)):
@@ -216,6 +341,16 @@ def runFlawDetector(vid_path = 0, base_dir=None, draw_callback = None):
                 os.remove(os.path.join(base_dir,dir_names[i],f))
 
     capture = cv2.VideoCapture(vid_path)
+    metrics = Metrics()
+    if sampling == 'motion':
+        sampler = MotionSampler(trigger_zone, min_area=OBJECT_AREA, low_v=LOW_V)
+    else:
+        sampler = FixedSampler(frame_number)
+    # Crops are encoded and written in the background, the frame loop only waits when the queue is full
+    writer = DefectWriter(base_dir, image_format, quality, writer_workers, archive, metrics=metrics)
+    # OpenCV releases the GIL, the checks of several objects run in parallel
+    executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+    start_time = time.time()
 
     # Check if video is loaded successfully
     if capture.isOpened():
@@ -227,19 +362,33 @@ def runFlawDetector(vid_path = 0, base_dir=None, draw_callback = None):
     # OpenCV video write to store the output video
     try:
         vw = None
+        frames_out = 0
         while True:
             # Read the frame from the stream
+            start = time.perf_counter()
+            if headless and not sampler.needs_frame(frame_count + 1):
+                # Nothing is drawn in headless mode, skip the frames the sampler does not look at
+                if not capture.grab():
+                    break
+                metrics.record('decode', time.perf_counter() - start)
+                frame_count += 1
+                continue
             _, frame = capture.read()
 
             if np.shape(frame) == ():
                 break
+            metrics.record('decode', time.perf_counter() - start)
 
             frame_count += 1
             object_count = "Object Number : {}".format(count_object)
 
-            # Check every given frame number (Number chosen based on the frequency of object on conveyor belt)
-            if frame_count % frame_number == 0:
+            # Check the frames chosen by the sampler: every given frame number (Number chosen based on the
+            # frequency of object on conveyor belt), or the frames where a new object enters the trigger zone
+            with metrics.measure('sample'):
+                sampled = sampler.sample(frame, frame_count)
+            if sampled:
                 defect = []
+                start = time.perf_counter()
 
                 # Convert BGR image to HSV color space
                 img_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
@@ -257,54 +406,80 @@ def runFlawDetector(vid_path = 0, base_dir=None, draw_callback = None):
 
                 # Find the contours on the image
                 contours, hierarchy = cv2.findContours(img_thresholded, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+                metrics.record('preprocess', time.perf_counter() - start)
 
+                start = time.perf_counter()
+                objects = []
                 for cnt in contours:
                     x, y, width, height = cv2.boundingRect(cnt)
-                    if width * height > OBJECT_AREA:
+                    if width * height > OBJECT_AREA and sampler.select(x, y, width, height):
                         count_object += 1
-                        frame_copy = frame.copy()
-                        object_count = "Object Number : {}".format(count_object)
-
-                        # Check for the orientation of the object
-                        orientation_flag, orientation_defect = detect_orientation(frame, cnt, base_dir, count_object)
-                        if orientation_flag == True:
-                            defect.append(str(orientation_defect))
-
-                        # Check for the color defect of the object
-                        color_flag, color_defect = detect_color(frame, cnt, base_dir, count_object)
-                        if color_flag == True:
-                            defect.append(str(color_defect))
-
-                        # Check for the crack defect of the object
-                        crack_flag, crack_defect, crack_contour = detect_crack(frame_copy, cnt, base_dir, count_object)
-                        if crack_flag == True:
-                            defect.append(str(crack_defect))
-                            cv2.drawContours(frame, crack_contour, -1, (0, 255, 0), 2)
-
-                        # Check if none of the defect is found
-                        if not defect:
-                            object_defect = "No Defect"
-                            defect.append(str(object_defect))
-                            print("No defect detected in object {}".format(count_object))
-                            cv2.imwrite("{}/no_defect/Nodefect_{}.jpg".format(base_dir, count_object), frame[y - 5: y + height + 10, x - 5: x + width + 10])
+                        objects.append((count_object, cnt, x, y, width, height))
+
+                # Check all the objects concurrently, results come back in object order;
+                # the frame is only drawn on once every check is done with it
+                conversions = shared_conversions(frame) if share_conversions and objects else None
+                results = list(executor.map(inspect_object, repeat(frame), [obj[1] for obj in objects],
+                                            repeat(base_dir), [obj[0] for obj in objects], repeat(conversions),
+                                            repeat(writer)))
+                for (number, cnt, x, y, width, height), (obj_defect, color_contours, crack_contour, checked, (x0, y0), messages) in zip(objects, results):
+                    # Print what the checks found on the pool threads in object order
+                    for message in messages:
+                        print(message)
+                    object_count = "Object Number : {}".format(number)
+                    defect.extend(obj_defect)
+                    report.append({'object': number, 'frame': frame_count, 'box': [x, y, width, height],
+                                   'defects': obj_defect or ["No Defect"]})
+
+                    # Draw on the output frame what the checks drew on their copy: the color check
+                    # brightens the frame and marks the defective areas, then the crack contour
+                    cv2.convertScaleAbs(frame, frame, 1, 20)
+                    for color_contour in color_contours:
+                        cv2.drawContours(frame, color_contour, -1, (0, 0, 255), 2)
+                    if crack_contour is not None:
+                        cv2.drawContours(frame, crack_contour, -1, (0, 255, 0), 2)
+
+                    # Check if none of the defect is found
+                    if not defect:
+                        object_defect = "No Defect"
+                        defect.append(str(object_defect))
+                        print("No defect detected in object {}".format(number))
+                        save_crop(base_dir, "no_defect", "Nodefect_{}".format(number), checked[max(y - y0 - 5, 0): y - y0 + height + 10, max(x - x0 - 5, 0): x - x0 + width + 10], writer)
+                metrics.record('postprocess', time.perf_counter() - start)
                 if not defect:
                     continue
 
+            if headless:
+                continue
+            frames_out += 1
+            # Annotate the frame only for the video and the frames given to draw_callback
+            start = time.perf_counter()
             all_defects = " ".join(defect)
-
             cv2.putText(frame, all_defects, (5, 130), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 255, 255), 2)
             cv2.putText(frame, object_count, (5, 50), cv2.FONT_HERSHEY_DUPLEX, 1, (255, 255, 255), 2)
-            if draw_callback != None:
+            if draw_callback != None and frames_out % callback_every == 0:
                 draw_callback(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            metrics.record('draw', time.perf_counter() - start)
             if vw == None:
                 height = np.size(frame, 0)
                 width = np.size(frame, 1)
                 out_dir = os.path.join(base_dir, 'inference_output.mp4')
                 vw = cv2.VideoWriter(out_dir, 0x00000021, 15.0, (width, height), True)
-            vw.write(frame)
+            with metrics.measure('encode'):
+                vw.write(frame)
     finally:
-        if vw != None:
-            vw.release()
+        executor.shutdown()
+        try:
+            # Waits for the crops still queued, so their save times are in the metrics; the first
+            # error saving a crop is only raised once the video, the report and the metrics are written
+            writer.close()
+        finally:
+            if vw != None:
+                vw.release()
+            with open(os.path.join(base_dir, 'defect_report.json'), 'w') as f:
+                json.dump({'video': str(vid_path), 'frames': frame_count, 'objects': report}, f, indent=2)
+            metrics.write(os.path.join(base_dir, 'metrics.json'), frames=frame_count,
+                          objects=count_object, total_s=round(time.time() - start_time, 3))
 
 
 if __name__ == '__main__':
@@ -312,9 +487,23 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-d', '--dir', required=False, help="Name of the directory to which defective images are saved")
     parser.add_argument('-f', '--vid', default=0, help="Name of the video file")
+    parser.add_argument('-w', '--workers', default=None, type=int, help="Threads checking the objects of a frame, one per core by default")
+    parser.add_argument('-s', '--share_conversions', action='store_true', help="Convert a sampled frame to HSV and gray once for all its objects")
+    parser.add_argument('-if', '--image_format', default='jpg', choices=sorted(FORMATS), help="Format of the saved crops")
+    parser.add_argument('-q', '--quality', default=95, type=int, help="Quality (0-100) of the jpg and webp crops")
+    parser.add_argument('-ww', '--writer_workers', default=1, type=int, help="Threads saving the crops in the background")
+    parser.add_argument('-a', '--archive', action='store_true', help="Append the crops of each category to a single zip file")
+    parser.add_argument('-sm', '--sampling', default='fixed', choices=['fixed', 'motion'], help="Inspect every frame_number-th frame, or each object once when it enters the trigger zone")
+    parser.add_argument('-fn', '--frame_number', default=40, type=int, help="Frames between two inspections with fixed sampling")
+    parser.add_argument('-tz', '--trigger_zone', default='0.25,0,0.75,1', help="Trigger zone of motion sampling as x0,y0,x1,y1 in fractions of the frame")
+    parser.add_argument('-hl', '--headless', action='store_true', help="Only save the crops and the defect report, without output video")
     args = vars(parser.parse_args())
     base_dir = args['dir']
     vid_path = args['vid']
-    runFlawDetector(vid_path, base_dir)
+    runFlawDetector(vid_path, base_dir, workers=args['workers'], share_conversions=args['share_conversions'],
+                    image_format=args['image_format'],
+                    quality=args['quality'], writer_workers=args['writer_workers'], archive=args['archive'],
+                    sampling=args['sampling'], frame_number=args['frame_number'],
+                    trigger_zone=tuple(float(v) for v in args['trigger_zone'].split(',')), headless=args['headless'])
 
 
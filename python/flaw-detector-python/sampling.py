@@ -0,0 +1,175 @@
+'''
+Choice of the frames and objects the flaw detector inspects.
+
+    sampler = MotionSampler(zone=(0.25, 0, 0.75, 1))
+    if sampler.sample(frame, frame_count):
+        # full HSV threshold on the frame
+        for cnt in contours:
+            if sampler.select(*cv2.boundingRect(cnt)):
+                # inspect the object
+
+FixedSampler inspects every object of every frame_number-th frame, a guess of
+the time an object takes to cross the camera view.
+
+MotionSampler runs a cheap foreground check on a downscaled copy of every
+frame and tracks the objects it finds from frame to frame (CentroidTracker).
+A frame is only sampled when an object not inspected yet has entered the
+trigger zone, and only those objects are selected, so every part is inspected
+once whatever the speed of the belt, and empty frames cost a resize and a
+threshold of a small image.
+'''
+
+import cv2
+import numpy as np
+
+
+class FixedSampler:
+    def __init__(self, frame_number=40):
+        """
+        :param frame_number: inspect every frame_number-th frame
+        """
+        self.frame_number = frame_number
+
+    def needs_frame(self, frame_count):
+        """Whether sample() needs frame number frame_count, the others do not have to be decoded"""
+        return frame_count % self.frame_number == 0
+
+    def sample(self, frame, frame_count):
+        return frame_count % self.frame_number == 0
+
+    def select(self, x, y, w, h):
+        return True
+
+
+class Track:
+    def __init__(self, box):
+        self.box = box
+        self.missing = 0
+        self.inspected = False
+
+    @property
+    def centroid(self):
+        x, y, w, h = self.box
+        return x + w / 2, y + h / 2
+
+
+class CentroidTracker:
+    def __init__(self, max_distance, max_missing=5):
+        """
+        :param max_distance: pixels the centroid of an object may move between two frames
+        :param max_missing: frames a track is kept without matching any object
+        """
+        self.max_distance = max_distance
+        self.max_missing = max_missing
+        self.tracks = {}
+        self.next_id = 0
+
+    def update(self, boxes):
+        """
+        Matches the boxes (x, y, w, h) of a frame to the tracks, closest centroids first
+        :return: tracks of the frame by id
+        """
+        ids = list(self.tracks)
+        unmatched = set(range(len(boxes)))
+        if ids and boxes:
+            prev = np.array([self.tracks[i].centroid for i in ids])
+            centroids = np.array([(x + w / 2, y + h / 2) for x, y, w, h in boxes])
+            distances = np.linalg.norm(prev[:, None] - centroids[None], axis=2)
+            matched = set()
+            for flat in np.argsort(distances, axis=None):
+                row, col = divmod(int(flat), len(boxes))
+                if distances[row, col] > self.max_distance:
+                    break
+                if ids[row] in matched or col not in unmatched:
+                    continue
+                track = self.tracks[ids[row]]
+                track.box = boxes[col]
+                track.missing = 0
+                matched.add(ids[row])
+                unmatched.discard(col)
+            for track_id in set(ids) - matched:
+                track = self.tracks[track_id]
+                track.missing += 1
+                if track.missing > self.max_missing:
+                    del self.tracks[track_id]
+        for col in sorted(unmatched):
+            self.tracks[self.next_id] = Track(boxes[col])
+            self.next_id += 1
+        return self.tracks
+
+
+class MotionSampler:
+    def __init__(self, zone=(0.25, 0.0, 0.75, 1.0), scale=0.25, min_area=9000, low_v=47,
+                 max_distance=0.1, max_missing=5):
+        """
+        :param zone: trigger zone (x0, y0, x1, y1) in fractions of the frame; an object is inspected
+                     once its centroid is in the zone and it is entirely in the frame
+        :param scale: scale of the frame for the foreground check
+        :param min_area: smallest bounding box of an object in pixels of the frame
+        :param low_v: brightness (HSV value) separating the objects from the belt
+        :param max_distance: distance an object may move between two frames, in fractions of the frame width
+        :param max_missing: frames an object may be lost before it is tracked as a new one
+        """
+        self.zone = zone
+        self.scale = scale
+        self.min_area = min_area * scale * scale
+        self.low_v = low_v
+        self.max_distance = max_distance
+        self.max_missing = max_missing
+        self.tracker = None
+        self.small = None
+        self.triggered = []
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+    def _foreground(self, frame):
+        """Boxes of the bright objects in frame coordinates, from a downscaled copy of the frame"""
+        height, width = frame.shape[:2]
+        size = (max(int(width * self.scale), 1), max(int(height * self.scale), 1))
+        if self.small is None or self.small.shape[1::-1] != size:
+            self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        cv2.resize(frame, size, dst=self.small, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(self.small, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (0, 0, self.low_v), (179, 255, 255))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+        contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        fx, fy = width / size[0], height / size[1]
+        boxes = []
+        for cnt in contours:
+            x, y, w, h = cv2.boundingRect(cnt)
+            if w * h > self.min_area:
+                boxes.append((x * fx, y * fy, w * fx, h * fy))
+        return boxes
+
+    def needs_frame(self, frame_count):
+        return True
+
+    def sample(self, frame, frame_count):
+        height, width = frame.shape[:2]
+        if self.tracker is None:
+            self.tracker = CentroidTracker(self.max_distance * width, self.max_missing)
+        tracks = self.tracker.update(self._foreground(frame))
+        x0, y0, x1, y1 = (self.zone[0] * width, self.zone[1] * height, self.zone[2] * width, self.zone[3] * height)
+        # One downscaled pixel of margin: objects touching the border are not entirely visible yet
+        margin = 1 / self.scale
+        self.triggered = []
+        for track in tracks.values():
+            x, y, w, h = track.box
+            cx, cy = track.centroid
+            if track.inspected or track.missing:
+                continue
+            if x < margin or y < margin or x + w > width - margin or y + h > height - margin:
+                continue
+            if x0 <= cx <= x1 and y0 <= cy <= y1:
+                self.triggered.append(track)
+        return bool(self.triggered)
+
+    def select(self, x, y, w, h):
+        """Selects an object of the sampled frame if it is a triggered object, which is then marked inspected"""
+        cx, cy = x + w / 2, y + h / 2
+        margin = 2 / self.scale
+        for track in self.triggered:
+            tx, ty, tw, th = track.box
+            if not track.inspected and tx - margin <= cx <= tx + tw + margin and ty - margin <= cy <= ty + th + margin:
+                track.inspected = True
+                return True
+        return False
@@ -4,38 +4,120 @@ import cv2
 import time
 import numpy as np
 import io
+import itertools
+import multiprocessing
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+sys.path.insert(0, str(Path().resolve().parent.parent))
+from demoTools.detections import RESULT_DTYPE, filter_detections, iter_frames, load_results
 
+# Codec of the rendered videos (H.264)
+FOURCC = 0x00000021
 
-def placeBoxes(res, labels_map, prob_threshold, frame, initial_w, initial_h, is_async_mode, cur_request_id, det_time):
-    for obj in res[0][0]:
-        # Draw only objects when probability more than specified threshold
-        if obj[2] > prob_threshold:
-            xmin = int(obj[3] * initial_w)
-            ymin = int(obj[4] * initial_h)
-            xmax = int(obj[5] * initial_w)
-            ymax = int(obj[6] * initial_h)
-            class_id = int(obj[1])
-            # Draw box and label\class_id
-            inf_time_message = "Inference time: N\A for async mode" if is_async_mode else \
-                    "Inference time: {:.3f} ms".format(det_time * 1000)
-            async_mode_message = "Async mode is on. Processing request {}".format(cur_request_id) if is_async_mode else \
-                    "Async mode is off. Processing request {}".format(cur_request_id)
+
+class BoxRenderer:
+    '''
+    Draws detections and the frame banners. Class colors and label strings are computed once
+    per class, the banners once per frame, whatever the number of boxes.
+    '''
+    def __init__(self, labels_map=None):
+        self.labels_map = labels_map
+        self.styles = {}
+        for class_id in range(len(labels_map) if labels_map else 0):
+            self._style(class_id)
+
+    def _style(self, class_id):
+        style = self.styles.get(class_id)
+        if style is None:
             color = (min(class_id * 12.5, 255), min(class_id * 7, 255), min(class_id * 5, 255))
+            det_label = self.labels_map[class_id] if self.labels_map else str(class_id)
+            style = self.styles[class_id] = (color, det_label + ' {:.1f} %')
+        return style
+
+    def draw(self, frame, boxes, initial_h, is_async_mode, cur_request_id, det_time):
+        '''
+        Draws all the detections of a frame
+        boxes: RESULT_DTYPE records of the frame (see demoTools/detections.py)
+        '''
+        if not len(boxes):
+            return frame
+        for xmin, ymin, xmax, ymax, class_id, confidence in zip(boxes['xmin'].tolist(), boxes['ymin'].tolist(),
+                                                                boxes['xmax'].tolist(), boxes['ymax'].tolist(),
+                                                                boxes['class_id'].tolist(), boxes['confidence'].tolist()):
+            color, label = self._style(class_id)
             cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
-            det_label = labels_map[class_id] if labels_map else str(class_id)
-            cv2.putText(frame, det_label + ' ' + str(round(obj[2] * 100, 1)) + ' %', (xmin, ymin - 7), cv2.FONT_HERSHEY_COMPLEX, 0.6, color, 1)
-            cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
-            cv2.putText(frame, async_mode_message, (10, int(initial_h - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,(10, 10, 200), 1)
+            cv2.putText(frame, label.format(confidence * 100), (xmin, ymin - 7), cv2.FONT_HERSHEY_COMPLEX, 0.6, color, 1)
+        self.draw_banners(frame, initial_h, is_async_mode, cur_request_id, det_time)
+        return frame
+
+    def draw_raw(self, frame, res, prob_threshold, initial_w, initial_h, is_async_mode, cur_request_id, det_time):
+        '''Draws the detections of a raw [1,1,N,7] output above prob_threshold'''
+        boxes = filter_detections(res[0][0], prob_threshold, initial_w, initial_h)
+        return self.draw(frame, boxes, initial_h, is_async_mode, cur_request_id, det_time)
+
+    def draw_banners(self, frame, initial_h, is_async_mode, cur_request_id, det_time):
+        if is_async_mode:
+            inf_time_message = "Infer wait: N\A for async mode"
+            async_mode_message = "Async mode is on. Processing request {}".format(cur_request_id)
+        else:
+            inf_time_message = "Infer wait: {:.3f} ms".format(det_time * 1000)
+            async_mode_message = "Async mode is off. Processing request {}".format(cur_request_id)
+        cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
+        cv2.putText(frame, async_mode_message, (10, int(initial_h - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,(10, 10, 200), 1)
+
+_renderer = BoxRenderer()
 
-    return frame
+def _rendererFor(labels_map):
+    global _renderer
+    if _renderer.labels_map is not labels_map:
+        _renderer = BoxRenderer(labels_map)
+    return _renderer
+
+def placeBoxes(res, labels_map, prob_threshold, frame, initial_w, initial_h, is_async_mode, cur_request_id, det_time):
+    # Draw only objects when probability more than specified threshold
+    return _rendererFor(labels_map).draw_raw(frame, res, prob_threshold, initial_w, initial_h, is_async_mode, cur_request_id, det_time)
+
+def drawBoxes(boxes, labels_map, frame, initial_h, is_async_mode, cur_request_id, det_time):
+    '''
+    Same drawing as placeBoxes for detections that are already filtered and scaled,
+    boxes: RESULT_DTYPE records of one frame (see demoTools/detections.py)
+    '''
+    return _rendererFor(labels_map).draw(frame, boxes, initial_h, is_async_mode, cur_request_id, det_time)
+
+def frameResults(res_arr):
+    '''
+    Iterates over the detections of every frame without loading them all in memory
+    res_arr: raw [1,1,N,7] outputs indexed by frame (numpy array or memmap) or any iterator of them,
+             or the binary result file / RESULT_DTYPE records written by object_detection_demo_ssd_async.py
+    '''
+    if isinstance(res_arr, str):
+        res_arr = load_results(res_arr)
+    if isinstance(res_arr, np.ndarray) and res_arr.dtype == RESULT_DTYPE:
+        return (boxes for _, boxes in iter_frames(res_arr))
+    return iter(res_arr)
 
 def post_process(input_stream, res_arr, labels_map, prob_threshold, out_path, det_time, is_async_mode):
+    '''
+    Draws the detections on the frames of input_stream and writes the video to out_path
+    res_arr: per-frame detections, see frameResults; consumed one frame at a time
+    det_time: per-frame inference times as a sequence or iterator, or a single value for all frames;
+              None uses the times stored in result records
+    '''
     post_process = time.time()
+    results = frameResults(res_arr)
+    if det_time is None or np.isscalar(det_time):
+        det_times = itertools.repeat(det_time or 0)
+    else:
+        det_times = iter(det_time)
+    det_time_val = 0
+    renderer = BoxRenderer(labels_map)
     cap = cv2.VideoCapture(input_stream)
     if cap.isOpened():   
         width  = int(cap.get(3))
         height = int(cap.get(4))
-        vw = cv2.VideoWriter(out_path, 0x00000021, 50.0, (width, height), True)
+        vw = cv2.VideoWriter(out_path, FOURCC, 50.0, (width, height), True)
     i = 0
     while cap.isOpened():
         ret, frame = cap.read()
@@ -43,10 +125,16 @@ def post_process(input_stream, res_arr, labels_map, prob_threshold, out_path, de
             break
         initial_w = cap.get(3)
         initial_h = cap.get(4)
-        if i < res_arr.shape[0]:
-            res = res_arr[i]
-            if len(det_time): det_time_val = det_time.pop(0)
-            if i%2 == 0: frame = placeBoxes(res, labels_map, prob_threshold, frame, initial_w, initial_h, is_async_mode, i, det_time_val)
+        res = next(results, None)
+        if res is not None:
+            det_time_val = next(det_times, det_time_val)
+            if i%2 == 0:
+                if res.dtype == RESULT_DTYPE:
+                    if det_time is None and len(res):
+                        det_time_val = float(res['det_time'][0])
+                    frame = renderer.draw(frame, res, initial_h, is_async_mode, i, det_time_val)
+                else:
+                    frame = renderer.draw_raw(frame, res, prob_threshold, initial_w, initial_h, is_async_mode, i, det_time_val)
         vw.write(frame)
         i+=1
         key = cv2.waitKey(1)
@@ -56,4 +144,120 @@ def post_process(input_stream, res_arr, labels_map, prob_threshold, out_path, de
     cap.release()
     vw.release()
 
+def seek_frame(cap, input_stream, start):
+    '''
+    Positions cap on frame start of input_stream and returns the capture to read from.
+    Seeking is not frame-accurate on every codec (an H.264 stream can land on a keyframe nearby),
+    so the position reached is checked and the missing frames are grabbed, from the first frame
+    of the stream if the seek went past start
+    '''
+    if start == 0:
+        return cap
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if pos < 0 or pos > start:
+        cap.release()
+        cap = cv2.VideoCapture(input_stream)
+        pos = 0
+    while pos < start and cap.grab():
+        pos += 1
+    return cap
 
+def render_chunk(input_stream, res_path, labels_map, prob_threshold, segment_path, start, end, det_time, is_async_mode):
+    '''
+    Renders frames [start, end) of input_stream to segment_path, same drawing as post_process
+    res_path: binary result file or .npy file of raw outputs, memory-mapped by every worker
+    '''
+    cv2.setNumThreads(1)
+    if res_path.endswith('.npy'):
+        results = np.load(res_path, mmap_mode='r')
+        boxes = None
+    else:
+        results = None
+        boxes = load_results(res_path)
+        first = int(np.searchsorted(boxes['frame'], start, side='left'))
+        boxes = boxes[first:]
+    cap = seek_frame(cv2.VideoCapture(input_stream), input_stream, start)
+    width  = int(cap.get(3))
+    height = int(cap.get(4))
+    vw = cv2.VideoWriter(segment_path, FOURCC, 50.0, (width, height), True)
+    det_time_val = det_time or 0
+    renderer = BoxRenderer(labels_map)
+    i = start
+    while i < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if boxes is not None:
+            last = int(np.searchsorted(boxes['frame'], i, side='right'))
+            res, boxes = boxes[:last], boxes[last:]
+            if i%2 == 0:
+                if det_time is None and len(res):
+                    det_time_val = float(res['det_time'][0])
+                frame = renderer.draw(frame, res, height, is_async_mode, i, det_time_val)
+        elif i < results.shape[0] and i%2 == 0:
+            frame = renderer.draw_raw(frame, results[i], prob_threshold, width, height, is_async_mode, i, det_time_val)
+        vw.write(frame)
+        i+=1
+    cap.release()
+    vw.release()
+    return segment_path, i - start
+
+def _render_chunk(args):
+    return render_chunk(*args)
+
+def concat_segments(segments, out_path):
+    '''Joins the rendered segments in order, without re-encoding when ffmpeg is available'''
+    if shutil.which('ffmpeg'):
+        list_path = out_path + '.segments.txt'
+        with open(list_path, 'w') as f:
+            for segment in segments:
+                f.write("file '{}'\n".format(os.path.abspath(segment)))
+        ret = subprocess.call(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                               '-i', list_path, '-c', 'copy', out_path])
+        os.remove(list_path)
+        if ret == 0:
+            return
+    vw = None
+    for segment in segments:
+        cap = cv2.VideoCapture(segment)
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if vw is None:
+                vw = cv2.VideoWriter(out_path, FOURCC, 50.0, (frame.shape[1], frame.shape[0]), True)
+            vw.write(frame)
+        cap.release()
+    if vw is not None:
+        vw.release()
+
+def post_process_parallel(input_stream, res_path, labels_map, prob_threshold, out_path, det_time, is_async_mode,
+                          workers=None, chunk_frames=None):
+    '''
+    post_process split over worker processes: every worker seeks to its own frame range, renders it
+    to a segment and the segments are joined in order into out_path
+    res_path: binary result file or .npy file of raw outputs (see render_chunk)
+    det_time: a single inference time for all frames, or None to use the times stored in result records
+    workers: number of worker processes, all cores by default
+    chunk_frames: frames per segment, the video is split evenly between the workers by default
+    '''
+    post_process = time.time()
+    cap = cv2.VideoCapture(input_stream)
+    length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    workers = workers or os.cpu_count() or 1
+    chunk_frames = chunk_frames or max(1, -(-length // workers))
+    segment_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(out_path)))
+    chunks = []
+    for idx, start in enumerate(range(0, length, chunk_frames)):
+        segment_path = os.path.join(segment_dir, 'segment_{:05d}.mp4'.format(idx))
+        chunks.append((input_stream, res_path, labels_map, prob_threshold, segment_path,
+                       start, min(start + chunk_frames, length), det_time, is_async_mode))
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            segments = [segment for segment, frames in pool.imap(_render_chunk, chunks)]
+        concat_segments(segments, out_path)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+    print("Post processing time: {0} sec" .format(time.time()-post_process))
@@ -24,10 +24,20 @@ import time
 import logging as log
 import numpy as np
 import io
-from openvino.inference_engine import IENetwork, IEPlugin
 from pathlib import Path
 sys.path.insert(0, str(Path().resolve().parent.parent))
-from demoTools.demoutils import progressUpdate
+from demoTools.jobutils import progressUpdate, writeStats
+from demoTools.infercache import InferCache, default_directory
+from demoTools.inferpool import InferRequestPool, InferResult, load_network
+from demoTools.pipeline import Pipeline, Stage
+from demoTools.detections import ResultWriter, filter_detections
+from demoTools.metrics import Metrics
+from demoTools.preprocess import Preprocessor
+from out_process import BoxRenderer
+if os.environ.get('IE_BACKEND') == 'fake':
+    from demoTools.fakeie import IENetwork, IEPlugin
+else:
+    from openvino.inference_engine import IENetwork, IEPlugin
 
 
 def build_argparser():
@@ -49,27 +59,32 @@ def build_argparser():
                         default=0.5, type=float)
     parser.add_argument("-o", "--output_dir", help="If set, it will write a video here instead of displaying it",
                         default=None, type=str)
+    parser.add_argument("-nr", "--num_requests", help="Number of infer requests kept in flight, or 'auto' to use the "
+                             "usual number for the device", default="auto", type=str)
+    parser.add_argument("-qs", "--queue_size", help="Number of frames buffered between two pipeline stages",
+                        default=8, type=int)
+    parser.add_argument("-rf", "--result_format", help="Format of the detection results file: text (output_<job>.txt), "
+                             "binary (output_<job>.bin) or both", default="text", choices=["text", "binary", "both"],
+                        type=str)
+    parser.add_argument("-r", "--render", help="'inline' draws the boxes on the decoded frames and writes "
+                             "output_<job>.mp4 during inference instead of leaving it to ROI_writer",
+                        default="none", choices=["none", "inline"], type=str)
+    parser.add_argument("-rs", "--render_scale", help="Scale of the inline rendered video relative to the input",
+                        default=1.0, type=float)
+    parser.add_argument("-sf", "--skip_frame", help="Write only every skip_frame-th frame to the inline rendered video",
+                        default=1, type=int)
+    parser.add_argument("-ic", "--infer_cache", help="Directory of the cache of the network outputs ($INFER_CACHE_DIR by "
+                             "default); a rerun on the same video, model and device skips decoding and inference",
+                        default=default_directory(), type=str)
     return parser
 
 
 
 def processBoxes(frame_count, res, labels_map, prob_threshold, frame, initial_w, initial_h, result_file, det_time):
-    for obj in res[0][0]:
-        dims = ""
-        # Draw only objects when probability more than specified threshold
-        if obj[2] > prob_threshold:
-            xmin = str(int(obj[3] * initial_w))
-            ymin = str(int(obj[4] * initial_h))
-            xmax = str(int(obj[5] * initial_w))
-            ymax = str(int(obj[6] * initial_h))
-            class_id = str(int(obj[1]))
-            est = str(round(obj[2]*100, 1))
-            time = round(det_time*1000)
-            out_list = [str(frame_count), xmin, ymin, xmax, ymax, class_id, est, str(time)]
-            for i in range(len(out_list)):
-                dims += out_list[i]+' '
-            dims += '\n'
-            result_file.write(dims)
+    # Filter, scale and write all the detections of the frame at once
+    boxes = filter_detections(res, prob_threshold, initial_w, initial_h, frame_count, det_time)
+    result_file.write(boxes)
+    return boxes
 
 
 def main():
@@ -101,13 +116,27 @@ def main():
     assert len(net.outputs) == 1, "Sample supports only single output topologies"
     input_blob = next(iter(net.inputs))
     out_blob = next(iter(net.outputs))
-    log.info("Loading IR to the plugin...")
-    exec_net = plugin.load(network=net, num_requests=2)
     # Read and pre-process input image
     if isinstance(net.inputs[input_blob], list):
         n, c, h, w = net.inputs[input_blob]
     else:
         n, c, h, w = net.inputs[input_blob].shape
+    # Outputs of a previous run on the same video, model and device, or a writer recording this run's
+    cached = cache_writer = None
+    if args.infer_cache and args.input != 'cam':
+        cache = InferCache(args.infer_cache)
+        cache_key = cache.key(args.input, model_xml, args.device, (n, c, h, w))
+        cached = cache.lookup(cache_key)
+        if cached is None:
+            cache_writer = cache.writer(cache_key, video=os.path.abspath(args.input),
+                                        model=os.path.abspath(model_xml), device=args.device)
+        else:
+            log.info("Using the cached network outputs {} of {} frames".format(cache_key, len(cached)))
+    exec_net = None
+    if cached is None:
+        log.info("Loading IR to the plugin...")
+        exec_net = load_network(plugin, net, args.num_requests)
+        log.info("Using {} infer requests".format(len(exec_net.requests)))
     del net
     if args.input == 'cam':
         input_stream = 0
@@ -128,81 +157,148 @@ def main():
 
     cap = cv2.VideoCapture(input_stream)
     video_len = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    cur_request_id = 0
-    next_request_id = 1
-  
+    initial_w = cap.get(3)
+    initial_h = cap.get(4)
+    pool = InferRequestPool(exec_net, input_blob, out_blob) if exec_net is not None else None
+
     log.info("Starting inference in async mode...")
     log.info("To switch between sync and async modes press Tab button")
     log.info("To stop the sample execution press Esc button")
     job_id = os.environ['PBS_JOBID']
-    result_file = open(os.path.join(args.output_dir,'output_'+str(job_id)+'.txt'), "w")
+    result_file = ResultWriter(
+        os.path.join(args.output_dir,'output_'+str(job_id)+'.txt') if args.result_format != 'binary' else None,
+        os.path.join(args.output_dir,'output_'+str(job_id)+'.bin') if args.result_format != 'text' else None)
     progress_file_path = os.path.join(args.output_dir,'i_progress_'+str(job_id)+'.txt')
+    render_inline = args.render == 'inline'
+    if render_inline:
+        render_progress_path = os.path.join(args.output_dir,'v_progress_'+str(job_id)+'.txt')
+        render_size = (int(initial_w * args.render_scale), int(initial_h * args.render_scale))
+        renderer = BoxRenderer(labels_map)
+        vw = cv2.VideoWriter(os.path.join(args.output_dir,'output_'+str(job_id)+'.mp4'), 0x00000021,
+                             50.0/args.skip_frame, render_size, True)
 
     is_async_mode = True
-    render_time = 0
-    fps_sum = 0
     frame_count = 0
-    inf_list = []
-    res_list = []
-    try:
-        infer_time_start = time.time()
+    rendered_count = 0
+    metrics = Metrics()
+    # A buffer is reused once queue_size + 2 newer frames were preprocessed, by then it was submitted
+    preprocessor = Preprocessor((n, c, h, w), buffers=args.queue_size + 2)
+
+    # Pipeline stages: decode -> preprocess -> infer -> write (-> render), each on its own thread
+    def decode():
         while cap.isOpened():
-            read_time = time.time()
+            start = time.perf_counter()
             ret, frame = cap.read()
             if not ret:
                 break
-            initial_w = cap.get(3)
-            initial_h = cap.get(4)
-
-            in_frame = cv2.resize(frame, (w, h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((n, c, h, w))
-            # Main sync point:
-            # in the truly Async mode we start the NEXT infer request, while waiting for the CURRENT to complete
-            # in the regular mode we start the CURRENT request and immediately wait for it's completion
-            inf_start = time.time()
-            if is_async_mode:
-                exec_net.start_async(request_id=next_request_id, inputs={input_blob: in_frame})
-            else:
-                exec_net.start_async(request_id=cur_request_id, inputs={input_blob: in_frame})
-
-
-            if exec_net.requests[cur_request_id].wait(-1) == 0:
-                inf_end = time.time()
-                det_time = inf_end - inf_start
-                #Parse detection results of the current request
-                res = exec_net.requests[cur_request_id].outputs[out_blob]
-                processBoxes(frame_count, res, labels_map, args.prob_threshold, frame, initial_w, initial_h, result_file, det_time)
-    
-            #
-            frame_count+=1
-            #Write data to progress tracker
-            if frame_count%10 == 0: 
-                progressUpdate(progress_file_path, time.time()-infer_time_start, frame_count, video_len) 
+            metrics.record('decode', time.perf_counter() - start)
+            yield frame
+
+    def preprocess(frame):
+        with metrics.measure('preprocess'):
+            # Resize and change data layout from HWC to CHW into a preallocated input buffer
+            in_frame = preprocessor.fill(frame)
+        # The decoded frame is only kept for inline rendering
+        return [(frame if render_inline else None, in_frame)]
+
+    submitted = [0]
+    def infer(item):
+        frame, in_frame = item
+        # in the truly Async mode the frame goes to the first free request of the pool and we only collect
+        # the requests the device has already finished; in the regular mode we wait for its completion
+        pool.sync = not is_async_mode
+        results = pool.submit(in_frame, tag=(submitted[0], frame))
+        submitted[0] += 1
+        return results
+
+    def replay():
+        # Cached outputs in frame order, the frames are only decoded to draw the boxes on
+        for i in range(len(cached)):
+            frame = None
+            if render_inline:
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                metrics.record('decode', time.perf_counter() - start)
+            frame_no, output, det_time = cached.frame(i)
+            yield InferResult((frame_no, frame), output, det_time, None)
 
+    def write(result):
+        nonlocal frame_count
+        frame_no, frame = result.tag
+        if cached is None:
+            metrics.record('infer_wait', result.det_time)
+        if cache_writer is not None:
+            cache_writer.append(frame_no, result.output, result.det_time)
+        #Parse detection results of the finished request
+        with metrics.measure('postprocess'):
+            boxes = processBoxes(frame_no, result.output, labels_map, args.prob_threshold, frame, initial_w, initial_h, result_file, result.det_time)
+        frame_count += 1
+        #Write data to progress tracker
+        if frame_count%10 == 0:
+            progressUpdate(progress_file_path, time.time()-infer_time_start, frame_count, video_len)
+        if render_inline and frame_no % args.skip_frame == 0:
+            return [(frame_no, frame, boxes, result.det_time)]
+
+    def render(item):
+        nonlocal rendered_count
+        frame_no, frame, boxes, det_time = item
+        with metrics.measure('draw'):
+            frame = renderer.draw(frame, boxes, initial_h, is_async_mode, frame_no, det_time)
+            if args.render_scale != 1.0:
+                frame = cv2.resize(frame, render_size)
+        with metrics.measure('encode'):
+            vw.write(frame)
+        rendered_count += 1
+        if rendered_count%10 == 0:
+            progressUpdate(render_progress_path, time.time()-infer_time_start, frame_no + 1, video_len)
+
+    if cached is None:
+        stages = [Stage('preprocess', preprocess),
+                  Stage('infer', infer, flush=pool.drain),
+                  Stage('write', write)]
+    else:
+        stages = [Stage('write', write)]
+    if render_inline:
+        stages.append(Stage('render', render))
+    if cached is None:
+        pipeline = Pipeline(decode(), stages, maxsize=args.queue_size)
+    else:
+        pipeline = Pipeline(replay(), stages, maxsize=args.queue_size, source_name='cache')
+    try:
+        infer_time_start = time.time()
+        pipeline.start()
+        while not pipeline.join(timeout=0.01):
             key = cv2.waitKey(1)
             if key == 27:
-                break
+                # Stop decoding; the frames already read are still written out
+                pipeline.stop()
             if (9 == key):
                 is_async_mode = not is_async_mode
                 log.info("Switched to {} mode".format("async" if is_async_mode else "sync"))
-            if is_async_mode:
-                cur_request_id, next_request_id = next_request_id, cur_request_id
-
- 	##End while loop /
+        log.info("Pipeline statistics:\n" + pipeline.report())
         cap.release()
         result_file.close()
+        # Only the outputs of the whole video are cached, not those of a run stopped with Esc
+        if cache_writer is not None and not pipeline.stopping.is_set():
+            cache_writer.commit()
+        if render_inline:
+            vw.release()
+            progressUpdate(render_progress_path, time.time()-infer_time_start, video_len, video_len)
 
         if args.output_dir is None:
             cv2.destroyAllWindows()
         else:
             total_time = time.time() - infer_time_start
-            with open(os.path.join(args.output_dir, 'stats.txt'), 'w') as f:
-                f.write(str(round(total_time, 1))+'\n')
-                f.write(str(frame_count)+'\n')
+            writeStats(os.path.join(args.output_dir, 'stats.txt'), total_time, frame_count)
+            metrics.write(os.path.join(args.output_dir, 'metrics.json'), device=args.device,
+                          frames=frame_count, total_s=round(total_time, 3))
 
 
     finally:
+        if cache_writer is not None:
+            cache_writer.abort()
         del exec_net
         del plugin
 
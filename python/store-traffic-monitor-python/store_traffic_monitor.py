@@ -37,12 +37,20 @@ import time
 import datetime
 import collections
 import threading
+import queue
 import datetime
 import math
-from openvino.inference_engine import IENetwork, IEPlugin
 from pathlib import Path
 sys.path.insert(0, str(Path().resolve().parent.parent))
-from demoTools.demoutils import progressUpdate
+from demoTools.infercache import InferCache, default_directory
+from demoTools.jobutils import progressUpdate, writeStats
+from demoTools.inferpool import InferRequestPool, load_network
+from demoTools.metrics import Metrics
+from demoTools.preprocess import Preprocessor
+if os.environ.get('IE_BACKEND') == 'fake':
+    from demoTools.fakeie import IENetwork, IEPlugin
+else:
+    from openvino.inference_engine import IENetwork, IEPlugin
 
 
 
@@ -60,9 +68,15 @@ STATS_WINDOW_NAME = 'Statistics'
 CAM_WINDOW_NAME_TEMPLATE = 'inference_output_Video_{}'
 PROB_THRESHOLD = 0.145
 FRAME_THRESHOLD = 5
+BATCH_SIZE = 1
+NUM_REQUESTS = 'auto'
+FRAME_POLICY = 'auto'
+FRAME_BUFFER = 4
 WINDOW_COLUMNS = 3
-#LOOP_VIDEO = False
+LOOP_VIDEO = False
 UI_OUTPUT = False
+RENDER_QUEUE_SIZE = 16
+INFER_CACHE = default_directory()
 
 ##########################################################
 # GLOBALS
@@ -74,6 +88,10 @@ labels_file = ''
 videoCaps = []
 display_lock = threading.Lock()
 log_lock = threading.Lock()
+# Set by the reader threads whenever a frame is buffered or a stream ends
+frame_ready = threading.Event()
+# Stage times of all the streams
+metrics = Metrics()
 frames = 0
 frameNames = []
 numVids = 20000
@@ -95,6 +113,7 @@ class VideoCap:
         self.cap_name = cap_name
         self.is_cam = False
         #self.is_cam = is_cam
+        self.live = is_cam
         self.cur_frame = numpy.array([], dtype='uint8')
         self.initial_w = 0
         self.initial_h = 0
@@ -108,28 +127,185 @@ class VideoCap:
         self.countAtFrame = []
         self.video = None
         self.rate = 0
+        self.class_id = None
+        self.path = None
+        # Outputs of a previous run on this stream, or the writer recording the outputs of this run
+        self.cached = None
+        self.cache_index = 0
+        self.cache_writer = None
 
         if not is_cam:
             self.fps = self.cap.get(cv2.CAP_PROP_FPS)
             self.length = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
         else:
             self.fps = 0
+            # Live streams have no length, every frame they hand out is inferred
+            self.length = 0
+            self.rate = 1
 
         self.videoName = cap_name + ".mp4"
 
+    def start_reader(self, policy, buffer_size):
+        """
+            Starts decoding the stream on a background thread into a buffer of buffer_size frames.
+            policy 'latest' drops the oldest buffered frame when the buffer is full and hands out
+            only the newest one, 'lossless' pauses decoding until the buffer has room and hands out
+            every frame in order
+        """
+        self.policy = policy
+        self.buffer_size = buffer_size
+        self.buffer = collections.deque()
+        self.buffer_cond = threading.Condition()
+        self.dropped = 0
+        self.handed_out = 0
+        self.eos = False
+        self.stopping = False
+        self.initial_w = self.cap.get(3)
+        self.initial_h = self.cap.get(4)
+        self.reader = threading.Thread(target=self._read_loop, name=self.cap_name)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def stop_reader(self):
+        with self.buffer_cond:
+            self.stopping = True
+            self.buffer_cond.notify_all()
+        self.reader.join()
+
+    def _read_loop(self):
+        try:
+            while not self.stopping:
+                # Keep one frame out of every rate frames
+                start = time.perf_counter()
+                for i in range(self.rate):
+                    ret, frame = self.cap.read()
+                    if not ret:
+                        break
+                    self.cur_frame_count += 1
+                if not ret:
+                    # Loop video if LOOP_VIDEO = True and input isn't live from USB camera
+                    if LOOP_VIDEO and not self.live and self.cur_frame_count:
+                        self.cur_frame_count = 0
+                        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        continue
+                    break
+                metrics.record('decode', time.perf_counter() - start)
+                with self.buffer_cond:
+                    if self.policy == 'lossless':
+                        while len(self.buffer) >= self.buffer_size and not self.stopping:
+                            self.buffer_cond.wait()
+                    elif len(self.buffer) >= self.buffer_size:
+                        self.buffer.popleft()
+                        self.dropped += 1
+                    self.buffer.append((self.cur_frame_count, frame))
+                    self.buffer_cond.notify_all()
+                frame_ready.set()
+        finally:
+            # A failing decoder ends the stream instead of leaving the inference loop waiting
+            with self.buffer_cond:
+                self.eos = True
+                self.buffer_cond.notify_all()
+            frame_ready.set()
+
+    def read(self):
+        """
+            Returns (frame number, frame) of the next frame to infer on.
+            With the 'latest' policy it never waits for the decoder and returns None if no new frame
+            was decoded yet; 'lossless' waits for the next frame. Closes the capture once the stream
+            ended and every buffered frame was read
+        """
+        with self.buffer_cond:
+            if self.policy == 'lossless':
+                while not self.buffer and not self.eos:
+                    self.buffer_cond.wait()
+            if not self.buffer:
+                if self.eos:
+                    self.closed = True
+                return None
+            if self.policy == 'latest':
+                item = self.buffer.pop()
+                self.dropped += len(self.buffer)
+                self.buffer.clear()
+            else:
+                item = self.buffer.popleft()
+            self.handed_out += 1
+            self.buffer_cond.notify_all()
+            return item
+
     def init_vw(self, h, w, fps):
         self.video = cv2.VideoWriter(os.path.join(output_dir, self.videoName), 0x00000021, fps, (w, h), True)
         if not self.video.isOpened():
             print ("Could not open for write" + self.videoName)
             sys.exit(1)
 
+class RenderWorker:
+    """
+        Draws the overlays and the statistics frames and writes the output videos on its own thread,
+        fed by the inference loop through a bounded queue
+    """
+    def __init__(self, statsVideo, statsHeight, statsWidth, w, h, maxsize=RENDER_QUEUE_SIZE):
+        self.statsVideo = statsVideo
+        self.w = w
+        self.h = h
+        # The statistics canvas is reused and only redrawn when the rolling log changes
+        self.stats = numpy.zeros((statsHeight, statsWidth, 1), dtype = 'uint8')
+        self.stats_frame = cv2.cvtColor(self.stats, cv2.COLOR_GRAY2BGR)
+        self.logs = ()
+        self.error = None
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.thread = threading.Thread(target=self._run, name='render')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add_frame(self, videoCap, frame, boxes, infer_duration, is_async_mode):
+        # The counts are copied now, the inference loop keeps updating them
+        self.queue.put((annotate_frame, (videoCap, frame, boxes, videoCap.total_count, videoCap.last_correct_count,
+                                         infer_duration, is_async_mode, self.w, self.h)))
+
+    def add_stats(self, logs):
+        self.queue.put((self._write_stats, (tuple(logs),)))
+
+    def close(self):
+        """Waits for the queued frames to be written and re-raises the first drawing error"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _write_stats(self, logs):
+        if logs != self.logs:
+            start = time.perf_counter()
+            self.logs = logs
+            self.stats[:] = 0
+            for i, log in enumerate(logs):
+                cv2.putText(self.stats, log, (10, i * 20 + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+            cv2.cvtColor(self.stats, cv2.COLOR_GRAY2BGR, dst=self.stats_frame)
+            metrics.record('draw', time.perf_counter() - start)
+        #cv2.imshow(STATS_WINDOW_NAME, self.stats_frame)
+        with metrics.measure('encode'):
+            self.statsVideo.write(self.stats_frame)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                # Keep draining so the inference loop never blocks on a full queue
+                continue
+            fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                self.error = e
+
 
 ##########################################################
 # FUNCTIONS
 ##########################################################
 
 def env_parser():
-    global TARGET_DEVICE, numVids, LOOP_VIDEO
+    global TARGET_DEVICE, numVids, LOOP_VIDEO, BATCH_SIZE, FRAME_POLICY, INFER_CACHE
     if 'DEVICE' in os.environ:
         TARGET_DEVICE = os.environ['DEVICE']
 
@@ -143,6 +319,15 @@ def env_parser():
     if 'NUM_VIDEOS' in os.environ:
         numVids = int(os.environ['NUM_VIDEOS'])
 
+    if 'BATCH_SIZE' in os.environ:
+        BATCH_SIZE = int(os.environ['BATCH_SIZE'])
+
+    if 'FRAME_POLICY' in os.environ:
+        FRAME_POLICY = os.environ['FRAME_POLICY']
+
+    if 'INFER_CACHE_DIR' in os.environ:
+        INFER_CACHE = os.environ['INFER_CACHE_DIR']
+
 def args_parser():
     parser = ArgumentParser()
     parser.add_argument("-d", "--device",
@@ -157,8 +342,16 @@ def args_parser():
     parser.add_argument("-c", "--config_file", help = "Path to config file", type = str, default = None)
     parser.add_argument("-n", "--num_videos", help = "Number of videos to process", type = int, default = None)
     parser.add_argument("-o", "--output_dir", help = "Path to output directory", type = str, default = None)
+    parser.add_argument("-b", "--batch_size", help = "Number of streams packed into one inference request", type = int, default = None)
+    parser.add_argument("-nr", "--num_requests", help = "Number of inference requests in flight, or 'auto' for the device's usual number", type = str, default = None)
+    parser.add_argument("-fp", "--frame_policy", help = "'latest' infers on the newest decoded frame and drops the others, 'lossless' infers on every frame; "
+                                                      "'auto' uses latest for cameras and lossless for video files", type = str, default = None,
+                        choices = ['auto', 'latest', 'lossless'])
+    parser.add_argument("-fb", "--frame_buffer", help = "Number of decoded frames buffered per stream", type = int, default = None)
+    parser.add_argument("-ic", "--infer_cache", help = "Directory of the cache of the network outputs; streams of video files already "
+                                                     "inferred with the same model and device are counted without inference", type = str, default = None)
 
-    global model_xml, model_bin, TARGET_DEVICE, labels_file, CPU_EXTENSION, LOOP_VIDEO, config_file, num_videos, output_dir
+    global model_xml, model_bin, TARGET_DEVICE, labels_file, CPU_EXTENSION, LOOP_VIDEO, config_file, num_videos, output_dir, BATCH_SIZE, NUM_REQUESTS, FRAME_POLICY, FRAME_BUFFER, INFER_CACHE
 
     args = parser.parse_args()
     if args.model:
@@ -182,6 +375,16 @@ def args_parser():
         num_videos = args.num_videos
     if args.output_dir:
         output_dir = args.output_dir
+    if args.batch_size:
+        BATCH_SIZE = args.batch_size
+    if args.num_requests:
+        NUM_REQUESTS = args.num_requests
+    if args.frame_policy:
+        FRAME_POLICY = args.frame_policy
+    if args.frame_buffer:
+        FRAME_BUFFER = args.frame_buffer
+    if args.infer_cache:
+        INFER_CACHE = args.infer_cache
 
 
 def check_args(defaultTarget=None):
@@ -218,6 +421,7 @@ def parse_conf_file():
                 else:
                     if os.path.isfile(split[0]) :
                         videoCap = VideoCap(cv2.VideoCapture(split[0]), split[1], CAM_WINDOW_NAME_TEMPLATE.format(idx), False)
+                        videoCap.path = split[0]
                     else:
                         print ("Couldn't find " + split[0])
                         sys.exit(3)
@@ -311,6 +515,146 @@ def arrange_windows(width, height):
 #
 #        return 0
 
+def count_objects(videoCapResult, detections):
+    """
+        Counts the detections of the label requested for videoCapResult and updates its counts once the
+        number of objects is stable for FRAME_THRESHOLD frames
+        detections: rows of the SSD output [image_id, label, conf, x_min, y_min, x_max, y_max] for this frame
+        Returns the boxes of the counted objects as [xmin, ymin, xmax, ymax] rows in pixels of frame
+    """
+    # Count only objects when probability more than specified threshold
+    found = detections[(detections[:, 2] > PROB_THRESHOLD) & (detections[:, 1] == videoCapResult.class_id)]
+    current_count = len(found)
+    boxes = (found[:, 3:7] * [videoCapResult.initial_w, videoCapResult.initial_h,
+                              videoCapResult.initial_w, videoCapResult.initial_h]).astype(int)
+
+    if videoCapResult.candidate_count == current_count:
+        videoCapResult.candidate_confidence += 1
+    else:
+        videoCapResult.candidate_confidence = 0
+        videoCapResult.candidate_count = current_count
+
+    if videoCapResult.candidate_confidence == FRAME_THRESHOLD:
+        videoCapResult.candidate_confidence = 0
+        if current_count > videoCapResult.last_correct_count:
+            videoCapResult.total_count += current_count - videoCapResult.last_correct_count
+
+        if current_count != videoCapResult.last_correct_count:
+            if UI_OUTPUT:
+                currtime = datetime.datetime.now().strftime("%H:%M:%S")
+                fr = FrameInfo(videoCapResult.frames, current_count, currtime)
+                videoCapResult.countAtFrame.append(fr)
+            new_objects = current_count - videoCapResult.last_correct_count
+            for _ in range(new_objects):
+                str = "{} - {} detected on {}".format(time.strftime("%H:%M:%S"), videoCapResult.req_label, videoCapResult.cap_name)
+                rolling_log.append(str)
+
+        videoCapResult.frames+=1
+        videoCapResult.last_correct_count = current_count
+    else:
+        videoCapResult.frames+=1
+    return boxes
+
+def annotate_frame(videoCapResult, frame, boxes, total_count, last_correct_count, infer_duration, is_async_mode, w, h):
+    """
+        Draws the counted objects on a frame of videoCapResult, resizes it to the network size,
+        adds the count overlays and writes it. Runs on the RenderWorker thread
+        boxes: counted objects returned by count_objects
+        total_count, last_correct_count: counts of the stream when the frame was counted
+        infer_duration: seconds the request of this frame was in flight
+    """
+    start = time.perf_counter()
+    for xmin, ymin, xmax, ymax in boxes.tolist():
+        # Draw box
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 4, 16)
+    out_frame = cv2.resize(frame, (w, h))
+    # Add log text to each frame
+    log_message = "Async mode is on." if is_async_mode else \
+                  "Async mode is off."
+    cv2.putText(out_frame, log_message, (15, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    log_message = "Total {} count: {}".format(videoCapResult.req_label, total_count)
+    cv2.putText(out_frame, log_message, (10, h - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    log_message = "Current {} count: {}".format(videoCapResult.req_label, last_correct_count)
+    cv2.putText(out_frame, log_message, (10, h - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    cv2.putText(out_frame, 'Infer wait: %0.3fs' % (infer_duration), (10, h - 70), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    end_time = datetime.datetime.now()
+    cv2.putText(out_frame, 'FPS: %0.2fs' % (1 / (end_time - videoCapResult.start_time).total_seconds()), (10, h - 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    #cv2.imshow(videoCapResult.cap_name, out_frame)
+    videoCapResult.start_time = datetime.datetime.now()
+    metrics.record('draw', time.perf_counter() - start)
+    #Write
+    with metrics.measure('encode'):
+        videoCapResult.video.write(out_frame)
+
+def handle_result(result, is_async_mode, render):
+    """
+        Completion handler of a request: counts the detections of every batch index on the stream the
+        request was tagged with and hands the frame over to the render worker
+    """
+    res = result.output.reshape(-1, 7)
+    for b, (videoCapResult, frame_no, frame) in enumerate(result.tag):
+        metrics.record('infer_wait', result.det_time)
+        detections = res[res[:, 0] == b]
+        if videoCapResult.cache_writer is not None:
+            videoCapResult.cache_writer.append(frame_no, detections, result.det_time)
+        with metrics.measure('postprocess'):
+            boxes = count_objects(videoCapResult, detections)
+        if render is not None:
+            render.add_frame(videoCapResult, frame, boxes, result.det_time, is_async_mode)
+
+def handle_cached(videoCap, frame_no, frame, is_async_mode, render):
+    """
+        Counts a frame of a stream whose outputs were cached by a previous run, without inference
+    """
+    if videoCap.cache_index >= len(videoCap.cached):
+        raise RuntimeError("Cached outputs {} end before {}".format(videoCap.cached.key, videoCap.path))
+    cached_no, detections, det_time = videoCap.cached.frame(videoCap.cache_index)
+    if cached_no != frame_no:
+        raise RuntimeError("Cached outputs {} do not match frame {} of {}".format(videoCap.cached.key, frame_no, videoCap.path))
+    videoCap.cache_index += 1
+    with metrics.measure('postprocess'):
+        boxes = count_objects(videoCap, detections)
+    if render is not None:
+        render.add_frame(videoCap, frame, boxes, det_time, is_async_mode)
+
+def stream_policy(videoCap):
+    """
+        Frame policy of a stream; with 'auto', cameras hand out only their newest frame so a slow
+        stream never makes the others lag behind
+    """
+    if FRAME_POLICY == 'auto':
+        return 'latest' if videoCap.live else 'lossless'
+    return FRAME_POLICY
+
+def open_cache(videoCaps, shape, policy):
+    """
+        Looks up the cached outputs of every stream of a video file, or starts recording them.
+        Only whole videos read frame by frame are cached: not cameras, looping videos or the 'latest' policy
+    """
+    cache = InferCache(INFER_CACHE)
+    for vc in videoCaps:
+        if vc.path is None or LOOP_VIDEO or policy(vc) != 'lossless':
+            continue
+        key = cache.key(vc.path, model_xml, TARGET_DEVICE, shape, rate=vc.rate)
+        vc.cached = cache.lookup(key)
+        if vc.cached is None:
+            vc.cache_writer = cache.writer(key, video=os.path.abspath(vc.path), model=os.path.abspath(model_xml),
+                                           device=TARGET_DEVICE, rate=vc.rate)
+        else:
+            print("Using the cached network outputs {} for {}".format(key, vc.path))
+
+def close_cache(videoCaps, completed):
+    """
+        Caches the outputs of the streams every frame of which went through the network
+    """
+    for vc in videoCaps:
+        if vc.cache_writer is None:
+            continue
+        if completed and vc.eos and not vc.buffer and len(vc.cache_writer.frames) == vc.handed_out:
+            vc.cache_writer.commit()
+        else:
+            vc.cache_writer.abort()
+
 def main():
     # Plugin initialization for specified device and load extensions library
     global rolling_log
@@ -338,18 +682,28 @@ def main():
     assert len(net.outputs) == 1, "Sample supports only single output topologies"
     input_blob = next(iter(net.inputs))
     out_blob = next(iter(net.outputs))
+    # Frames of up to BATCH_SIZE streams are packed into every request
+    if BATCH_SIZE > 1:
+        print("Reshaping network to batch size {}...".format(BATCH_SIZE))
+        net.batch_size = BATCH_SIZE
 
     # Load the IR
     print("Loading IR to the plugin...")
-    exec_net = plugin.load(network=net, num_requests=2)
+    exec_net = load_network(plugin, net, NUM_REQUESTS)
+    print("Using {} inference requests".format(len(exec_net.requests)))
     # Read and pre-process input image
     n, c, h, w = net.inputs[input_blob].shape
     del net
 
-    minFPS = min([i.cap.get(cv2.CAP_PROP_FPS) for i in videoCaps])
-    minlength = min([i.cap.get(cv2.CAP_PROP_FRAME_COUNT) for i in videoCaps])
-    for vc in videoCaps:
-        vc.rate = int(math.ceil(vc.length/minlength))
+    # Cameras may not report their frame rate
+    fps = [i.cap.get(cv2.CAP_PROP_FPS) for i in videoCaps]
+    minFPS = min([f for f in fps if f > 0] or [30.0])
+    # Video files are sampled so that they all end together with the shortest one, cameras keep rate 1
+    videoFiles = [vc for vc in videoCaps if not vc.live]
+    if videoFiles:
+        minlength = min([vc.length for vc in videoFiles])
+        for vc in videoFiles:
+            vc.rate = int(math.ceil(vc.length/minlength))
     print(minFPS)
     waitTime = int(round(1000 / minFPS / len(videoCaps))) # wait time in ms between showing frames
     frames_sum = 0
@@ -369,16 +723,25 @@ def main():
             labels_map = [x.strip() for x in f]
     else:
         labels_map = None
+    # Network class of the label counted on every stream, None if the label is unknown
+    for vc in videoCaps:
+        vc.class_id = labels_map.index(vc.req_label) + 1 if vc.req_label in labels_map else None
 
     # Init a rolling log to store events
     rolling_log_size = int((h - 15) / 20)
     rolling_log = collections.deque(maxlen=rolling_log_size)
 
-    # Init inference request IDs
-    cur_request_id = 0
-    next_request_id = 1
+    # Streams inferred by a previous run are counted from its outputs, the others record theirs
+    if INFER_CACHE:
+        open_cache(videoCaps, (1, c, h, w), stream_policy)
+
+    # Every request is tagged with the (stream, frame number, frame) of each batch index
+    pool = InferRequestPool(exec_net, input_blob, out_blob)
+    preprocessor = Preprocessor((n, c, h, w))
     # Start with async mode enabled
     is_async_mode = True
+    # Drawing and encoding run on their own thread, the inference loop only counts
+    render = None if UI_OUTPUT else RenderWorker(statsVideo, statsHeight, statsWidth, w, h)
 
     if not UI_OUTPUT:
         # Arrange windows so they are not overlapping
@@ -389,7 +752,11 @@ def main():
     
     for vc in videoCaps:
         vc.start_time = datetime.datetime.now()
+        vc.start_reader(stream_policy(vc), FRAME_BUFFER)
     frame_count = 0
+    # Progress only counts the frames of the video files, live streams have no end
+    video_frame_count = 0
+    progress_count = 0
     job_id = os.environ['PBS_JOBID']
     progress_file_path = os.path.join(output_dir,'i_progress_'+job_id+'.txt')
     infer_start_time = time.time()
@@ -398,138 +765,63 @@ def main():
     while True:
         # If all video captures are closed stop the loop
         if False not in [videoCap.closed for videoCap in videoCaps]:
-            print("I broke here line 387")
             break
 
         no_more_data = False
-
-        # loop over all video captures
-        for idx, videoCapInfer in enumerate(videoCaps):
-            # read the next frame
-            #print("Video {0} has length {1} and fps {2}".format(idx, videoCapInfer.length,  videoCapInfer.fps))
-            if not videoCapInfer.closed:
-                 #print("ID {0}".format(idx))
-                 vfps = int(round(videoCapInfer.cap.get(cv2.CAP_PROP_FPS)))
-                 #for i in range(0, int(round(vfps / minFPS))):
-                 for i in range(videoCapInfer.rate):
-                     frame_count += 1
-                     #print("i = {0}".format(i))
-                     ret, frame = videoCapInfer.cap.read()
-                     videoCapInfer.cur_frame_count += 1
-                     # If the read failed close the program
-                     if not ret:
-                         videoCapInfer.closed = True
-                         no_more_data = True
-                         break
-
-
-                 if videoCapInfer.closed:
-                     print("Video {0} is done".format(idx))
-                     print("Video has  {0} frames ".format(videoCapInfer.length))
-                     break
-
-                 # Copy the current frame for later use
-                 videoCapInfer.cur_frame = frame.copy()
-                 videoCapInfer.initial_w = videoCapInfer.cap.get(3)
-                 videoCapInfer.initial_h = videoCapInfer.cap.get(4)
-                 # Resize and change the data layout so it is compatible
-                 in_frame = cv2.resize(videoCapInfer.cur_frame, (w, h))
-                 in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-                 in_frame = in_frame.reshape((n, c, h, w))
-
-                 infer_start = datetime.datetime.now()
-                 if is_async_mode:
-                     exec_net.start_async(request_id=next_request_id, inputs={input_blob: in_frame})
-                     # Async enabled and only one video capture
-                     if(len(videoCaps) == 1):
-                         videoCapResult = videoCapInfer
-                     # Async enabled and more than one video capture
-                     else:
-                         # Get previous index
-                         videoCapResult = videoCaps[idx - 1 if idx - 1 >= 0 else len(videoCaps) - 1]
-                 else:
-                     # Async disabled
-                     exec_net.start_async(request_id=cur_request_id, inputs={input_blob: in_frame})
-                     videoCapResult = videoCapInfer
-                 
-                 if exec_net.requests[cur_request_id].wait(-1) == 0:
-                     infer_end = datetime.datetime.now()
-                     infer_duration = infer_end - infer_start
-                     current_count = 0
-                     # Parse detection results of the current request
-                     res = exec_net.requests[cur_request_id].outputs[out_blob]
-                     for obj in res[0][0]:
-                         class_id = int(obj[1])
-                         # Draw only objects when probability more than specified threshold
-                         if (obj[2] > PROB_THRESHOLD and
-                             videoCapResult.req_label in labels_map and
-                             labels_map.index(videoCapResult.req_label) == class_id - 1):
-                             current_count += 1
-                             xmin = int(obj[3] * videoCapResult.initial_w)
-                             ymin = int(obj[4] * videoCapResult.initial_h)
-                             xmax = int(obj[5] * videoCapResult.initial_w)
-                             ymax = int(obj[6] * videoCapResult.initial_h)
-                             # Draw box
-                             cv2.rectangle(videoCapResult.cur_frame, (xmin, ymin), (xmax, ymax), (0, 255, 0), 4, 16)
-
-                     if videoCapResult.candidate_count is current_count:
-                         videoCapResult.candidate_confidence += 1
-                     else:
-                         videoCapResult.candidate_confidence = 0
-                         videoCapResult.candidate_count = current_count
-
-                     if videoCapResult.candidate_confidence is FRAME_THRESHOLD:
-                         videoCapResult.candidate_confidence = 0
-                         if current_count > videoCapResult.last_correct_count:
-                             videoCapResult.total_count += current_count - videoCapResult.last_correct_count
-
-                         if current_count is not videoCapResult.last_correct_count:
-                             if UI_OUTPUT:
-                                 currtime = datetime.datetime.now().strftime("%H:%M:%S")
-                                 fr = FrameInfo(videoCapResult.frames, current_count, currtime)
-                                 videoCapResult.countAtFrame.append(fr)
-                             new_objects = current_count - videoCapResult.last_correct_count
-                             for _ in range(new_objects):
-                                 str = "{} - {} detected on {}".format(time.strftime("%H:%M:%S"), videoCapResult.req_label, videoCapResult.cap_name)
-                                 rolling_log.append(str)
-
-                         videoCapResult.frames+=1
-                         videoCapResult.last_correct_count = current_count
-                     else:
-                         videoCapResult.frames+=1
-
-                     videoCapResult.cur_frame = cv2.resize(videoCapResult.cur_frame, (w, h))
-
-                     if not UI_OUTPUT:
-                         # Add log text to each frame
-                         log_message = "Async mode is on." if is_async_mode else \
-                                       "Async mode is off."
-                         cv2.putText(videoCapResult.cur_frame, log_message, (15, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                         log_message = "Total {} count: {}".format(videoCapResult.req_label, videoCapResult.total_count)
-                         cv2.putText(videoCapResult.cur_frame, log_message, (10, h - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                         log_message = "Current {} count: {}".format(videoCapResult.req_label, videoCapResult.last_correct_count)
-                         cv2.putText(videoCapResult.cur_frame, log_message, (10, h - 30), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                         cv2.putText(videoCapResult.cur_frame, 'Infer wait: %0.3fs' % (infer_duration.total_seconds()), (10, h - 70), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                     
-                         # Display inferred frame and stats
-                         stats = numpy.zeros((statsHeight, statsWidth, 1), dtype = 'uint8')
-                         for i, log in enumerate(rolling_log):
-                             cv2.putText(stats, log, (10, i * 20 + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                         #cv2.imshow(STATS_WINDOW_NAME, stats)
-                         if idx == 0:
-                             stats = cv2.cvtColor(stats, cv2.COLOR_GRAY2BGR)
-                             #Write
-                             statsVideo.write(stats)
-                         end_time = datetime.datetime.now()
-                         cv2.putText(videoCapResult.cur_frame, 'FPS: %0.2fs' % (1 / (end_time - videoCapResult.start_time).total_seconds()), (10, h - 50), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-                         #cv2.imshow(videoCapResult.cap_name, videoCapResult.cur_frame)
-                         videoCapResult.start_time = datetime.datetime.now()
-                         #Write
-                         videoCapResult.video.write(videoCapResult.cur_frame)
-                      
-            if frame_count%10 == 0: 
-                progressUpdate(progress_file_path, time.time()-infer_start_time, frame_count, frames_sum) 
-
+        results_done = False
+        frames_read = False
+        frame_ready.clear()
+
+        # loop over the video captures in groups of n, one request per group
+        for first in range(0, len(videoCaps), n):
+            batch = []
+            for idx, videoCapInfer in enumerate(videoCaps[first:first + n], first):
+                if videoCapInfer.closed:
+                    continue
+                # take the next frame from the reader thread
+                item = videoCapInfer.read()
+                if item is None:
+                    if videoCapInfer.closed:
+                        print("Video {0} is done".format(idx))
+                        print("Video has  {0} frames ".format(videoCapInfer.length))
+                        no_more_data = True
+                        break
+                    # Nothing new decoded yet, the stream sits out this request
+                    continue
+                frame_no, frame = item
+                frame_count += videoCapInfer.rate
+                if not videoCapInfer.live:
+                    video_frame_count += videoCapInfer.rate
+                # Every frame handed out by the reader is a new array, keep it for later use
+                videoCapInfer.cur_frame = frame
+                if videoCapInfer.cached is not None:
+                    handle_cached(videoCapInfer, frame_no, frame, is_async_mode, render)
+                    frames_read = results_done = True
+                    continue
+                batch.append((videoCapInfer, frame_no, videoCapInfer.cur_frame))
+            if no_more_data:
+                break
+            if not batch:
+                continue
+            frames_read = True
+
+            # Resize and change the data layout so it is compatible, one stream per batch index,
+            # straight into the input of the next request; the outputs of unused indexes are ignored
+            in_frame = pool.next_input()
+            for b, (videoCapInfer, frame_no, frame) in enumerate(batch):
+                with metrics.measure('preprocess'):
+                    preprocessor.fill(frame, in_frame, b)
+
+            # In async mode the request goes to the first free slot and only the requests the device
+            # already finished are handled; in sync mode we wait for this request
+            pool.sync = not is_async_mode
+            for result in pool.submit(None, tag=batch):
+                handle_result(result, is_async_mode, render)
+                results_done = True
+
+            if frames_sum and video_frame_count - progress_count >= 10:
+                progress_count = video_frame_count
+                progressUpdate(progress_file_path, time.time()-infer_start_time, video_frame_count, frames_sum)
 
             # Wait if necessary for the required time
             #key = cv2.waitKey(waitTime)
@@ -537,6 +829,7 @@ def main():
             
             # Esc key pressed
             if key == 27:
+                close_cache(videoCaps, False)
                 cv2.destroyAllWindows()
                 del exec_net
                 del plugin
@@ -547,22 +840,26 @@ def main():
                 is_async_mode = not is_async_mode
                 print("Switched to {} mode".format("async" if is_async_mode else "sync"))
 
-            if is_async_mode:
-                # Swap infer request IDs
-                cur_request_id, next_request_id = next_request_id, cur_request_id
-
-            # Loop video if LOOP_VIDEO = True and input isn't live from USB camera
-            if LOOP_VIDEO and not videoCapInfer.is_cam:
-                vfps = int(round(videoCapInfer.cap.get(cv2.CAP_PROP_FPS)))
-                # If a video capture has ended restart it
-                if (videoCapInfer.cur_frame_count > videoCapInfer.cap.get(cv2.CAP_PROP_FRAME_COUNT) - int(round(vfps / minFPS))):
-                    videoCapInfer.cur_frame_count = 0
-                    videoCapInfer.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        
+        # Display stats, one frame per round over all the streams
+        if results_done and render is not None:
+            render.add_stats(rolling_log)
+
         if no_more_data:
-            progressUpdate(progress_file_path, time.time()-infer_start_time, frames_sum, frames_sum) 
             break
+        # Every reader was empty, wait for the next decoded frame instead of spinning
+        if not frames_read:
+            frame_ready.wait(0.01)
 #End of while loop--------------------
+    for vc in videoCaps:
+        vc.stop_reader()
+    # Handle the requests still in flight
+    for result in pool.drain():
+        handle_result(result, is_async_mode, render)
+    close_cache(videoCaps, True)
+    if render is not None:
+        render.close()
+    if frames_sum:
+        progressUpdate(progress_file_path, time.time()-infer_start_time, frames_sum, frames_sum)
     no_more_data = True
     t2 = time.time()-infer_start_time
     for videos in videoCaps:
@@ -572,13 +869,14 @@ def main():
     print("Total time {0}".format(t2))
     print("Total frame count {0}".format(frame_count))
     print("fps {0}".format(frame_count/t2))
-    with open(os.path.join(output_dir, 'stats.txt'), 'w') as f:
-        f.write('{} \n'.format(round(t2)))
-        f.write('{} \n'.format(frame_count))
+    writeStats(os.path.join(output_dir, 'stats.txt'), t2, frame_count)
+    metrics.write(os.path.join(output_dir, 'metrics.json'), device=TARGET_DEVICE, streams=len(videoCaps),
+                  frames=frame_count, total_s=round(t2, 3))
                  
 
     for vc in videoCaps:
         print("Frames processed {}".format(vc.cur_frame_count))
+        print("Frames dropped {}".format(vc.dropped))
         print("Frames count {}".format(vc.length))
 
 
@@ -586,8 +884,7 @@ def main():
         vc.video.release()
         vc.cap.release()
 
-        if no_more_data:
-            break
+    statsVideo.release()
 
 if __name__ == '__main__':
     sys.exit(main() or 0)
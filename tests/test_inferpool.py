@@ -0,0 +1,108 @@
+'''
+Tests of the infer request pool against the fake inference backend.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from demoTools import fakeie
+from demoTools.inferpool import InferRequestPool, load_network, AUTO_NUM_REQUESTS
+
+SHAPE = (1, 3, 8, 8)
+
+
+def make_pool(num_requests, ordered=True, parallel=1, latency=0.001):
+    '''Pool on a fake device; with parallel=0 the device never runs a request, the test completes them'''
+    net = fakeie.IENetwork()
+    net.reshape({'data': SHAPE})
+    device = fakeie._Device('CPU', latency=latency, parallel=parallel)
+    exec_net = fakeie.ExecutableNetwork(device, net, num_requests)
+    return InferRequestPool(exec_net, 'data', 'detection_out', ordered=ordered), exec_net
+
+
+def frame(i):
+    return np.full(SHAPE, i, dtype=np.float32)
+
+
+def expected_output(i):
+    net = fakeie.IENetwork()
+    net.reshape({'data': SHAPE})
+    request = fakeie.InferRequest(None, net)
+    request.inputs['data'][...] = frame(i)
+    request._run()
+    return request.outputs['detection_out']
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_completion_order(ordered):
+    pool, exec_net = make_pool(4, ordered=ordered, parallel=0)
+    for i in range(3):
+        assert pool.submit(frame(i), tag=i) == []
+    # The third request finishes first
+    exec_net.requests[2]._run()
+    ready = pool.submit(frame(3), tag=3)
+    assert [r.tag for r in ready] == ([] if ordered else [2])
+    for request_id in (0, 1, 3):
+        exec_net.requests[request_id]._run()
+    # Requests finished by the same harvest come back in submission order
+    tags = [r.tag for r in ready + pool.drain()]
+    assert tags == ([0, 1, 2, 3] if ordered else [2, 0, 1, 3])
+
+
+def test_drain():
+    pool, exec_net = make_pool(3)
+    results = []
+    for i in range(10):
+        results += pool.submit(frame(i), tag=i)
+    results += pool.drain()
+    assert [r.tag for r in results] == list(range(10))
+    assert not pool.in_flight
+    assert sorted(pool.free) == [0, 1, 2]
+    assert pool.drain() == []
+
+
+def test_request_reuse_and_next_input():
+    pool, exec_net = make_pool(2)
+    results = []
+    for i in range(6):
+        pool.next_input()[...] = frame(i)
+        results += pool.submit(None, tag=i)
+    results += pool.drain()
+    assert [r.tag for r in results] == list(range(6))
+    assert {r.request_id for r in results} == {0, 1}
+    # Every result keeps its own output although its request ran again afterwards
+    for r in results:
+        np.testing.assert_array_equal(r.output, expected_output(r.tag))
+        assert r.det_time >= 0
+
+
+def test_sync_mode():
+    pool, exec_net = make_pool(2)
+    pool.sync = True
+    for i in range(3):
+        assert [r.tag for r in pool.submit(frame(i), tag=i)] == [i]
+        assert not pool.in_flight
+
+
+def test_failure_status(monkeypatch):
+    pool, exec_net = make_pool(2, parallel=0)
+    pool.submit(frame(0), tag=0)
+    monkeypatch.setattr(exec_net.requests[0], 'wait', lambda timeout=-1: -1)
+    with pytest.raises(RuntimeError, match='status -1'):
+        pool.drain()
+    with pytest.raises(RuntimeError, match='status -1'):
+        pool.submit(frame(1), tag=1)
+
+
+def test_load_network():
+    net = fakeie.IENetwork()
+    plugin = fakeie.IEPlugin('HETERO:FPGA,CPU')
+    assert len(load_network(plugin, net, 'auto').requests) == AUTO_NUM_REQUESTS['FPGA']
+    assert len(load_network(plugin, net, '3').requests) == 3
@@ -0,0 +1,96 @@
+'''
+Tests of the parallel renderer of the SSD demos against the serial one, on a synthetic video.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmarks'))
+sys.path.insert(0, os.path.join(HERE, '..', 'python', 'object-detection-python'))
+import out_process
+from synthetic import make_video, make_results
+
+FRAMES = 40
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / 'input.mp4')
+    results = str(tmp_path / 'results.bin')
+    make_results(results, make_video(path, FRAMES, (160, 120), objects=3))
+    return path, results
+
+
+@pytest.fixture(autouse=True)
+def lossless(monkeypatch):
+    # The parallel renderer encodes every frame twice (segment, then joined video) without ffmpeg,
+    # a lossless codec lets the outputs be compared exactly
+    monkeypatch.setattr(out_process, 'FOURCC', cv2.VideoWriter_fourcc(*'FFV1'))
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+@pytest.mark.parametrize('start', [0, 1, 7, 13, 26, FRAMES - 1])
+def test_seek_frame(video, start):
+    path, _ = video
+    cap = out_process.seek_frame(cv2.VideoCapture(path), path, start)
+    ret, frame = cap.read()
+    cap.release()
+    assert ret
+    np.testing.assert_array_equal(frame, read_frames(path)[start])
+
+
+class InexactSeek:
+    '''Capture whose seeks land offset frames away from the frame asked for, like H.264 seeking to a keyframe'''
+
+    def __init__(self, cap, offset):
+        self.cap = cap
+        self.offset = offset
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value + self.offset)
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+@pytest.mark.parametrize('offset', [-5, 3])
+def test_seek_frame_inexact(video, offset):
+    path, _ = video
+    cap = out_process.seek_frame(InexactSeek(cv2.VideoCapture(path), offset), path, 13)
+    ret, frame = cap.read()
+    cap.release()
+    assert ret
+    np.testing.assert_array_equal(frame, read_frames(path)[13])
+
+
+def test_parallel_matches_serial(video, tmp_path):
+    path, results = video
+    serial = str(tmp_path / 'serial.mp4')
+    parallel = str(tmp_path / 'parallel.mp4')
+    out_process.post_process(path, results, None, 0.5, serial, None, True)
+    # Chunks of 7 frames start between the keyframes of the input
+    out_process.post_process_parallel(path, results, None, 0.5, parallel, None, True, workers=2, chunk_frames=7)
+    expected = read_frames(serial)
+    frames = read_frames(parallel)
+    assert len(expected) == len(frames) == FRAMES
+    for i, (a, b) in enumerate(zip(expected, frames)):
+        assert np.array_equal(a, b), 'frame {} differs'.format(i)
@@ -0,0 +1,158 @@
+'''
+Tests of the shared qstat poller with a fake qstat script.
+
+    python -m pytest tests
+'''
+
+import os
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+from demoTools.qstat import QstatPoller, parse_qstat
+
+HEADER = '''Job ID                    Name             User            Time Use S Queue
+------------------------- ---------------- --------------- -------- - -----
+'''
+
+# Prints the header and the jobs of the queue file, fails if the file says so, counts its runs
+FAKE_QSTAT = '''
+import sys
+queue, calls = sys.argv[1:]
+with open(calls, 'a') as f:
+    f.write('x')
+jobs = open(queue).read()
+if jobs.startswith('fail'):
+    sys.exit('qstat: cannot connect to server')
+sys.stdout.write({header!r} + jobs)
+'''.format(header=HEADER)
+
+
+def job(job_id, state='R', time_use='00:00:05'):
+    return '{}.c009                obj_det_core     u12345          {} {} batch\n'.format(job_id, time_use, state)
+
+
+class FakeQueue:
+    def __init__(self, path):
+        self.queue = str(path / 'queue')
+        self.calls = str(path / 'calls')
+        script = path / 'qstat.py'
+        script.write_text(FAKE_QSTAT)
+        self.cmd = [sys.executable, str(script), self.queue, self.calls]
+        self.set('')
+
+    def set(self, jobs):
+        with open(self.queue, 'w') as f:
+            f.write(jobs)
+
+    def runs(self):
+        return len(open(self.calls).read()) if os.path.exists(self.calls) else 0
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return FakeQueue(tmp_path)
+
+
+def wait_for(condition, timeout=10.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        time.sleep(0.005)
+
+
+def test_parse_qstat():
+    jobs = parse_qstat('Some banner\n' + HEADER + job(12345) + job(12346, 'Q') + 'short line\n')
+    assert list(jobs) == ['12345.c009', '12346.c009']
+    first = jobs['12345.c009']
+    assert (first.name, first.user, first.time_use, first.state, first.queue) == \
+           ('obj_det_core', 'u12345', '00:00:05', 'R', 'batch')
+    assert jobs['12346.c009'].state == 'Q'
+    assert parse_qstat('') == {}
+
+
+def test_diffs(queue):
+    poller = QstatPoller(cmd=queue.cmd)
+    queue.set(job(1) + job(2, 'Q'))
+    diff = poller.refresh()
+    assert list(diff.added) == ['1.c009', '2.c009'] and not diff.changed and not diff.removed
+    queue.set(job(2, 'R') + job(3))
+    diff = poller.refresh()
+    assert list(diff.added) == ['3.c009']
+    assert list(diff.removed) == ['1.c009']
+    old, new = diff.changed['2.c009']
+    assert (old.state, new.state) == ('Q', 'R')
+    assert list(diff.jobs) == ['2.c009', '3.c009']
+
+
+def test_failure_keeps_jobs(queue):
+    poller = QstatPoller(cmd=queue.cmd)
+    queue.set(job(1))
+    poller.refresh()
+    queue.set('fail')
+    diff = poller.refresh()
+    assert isinstance(poller.error, RuntimeError)
+    assert not diff.added and not diff.changed and not diff.removed
+    assert list(poller.jobs(max_age=60)) == ['1.c009']
+    queue.set(job(1))
+    poller.refresh()
+    assert poller.error is None
+
+
+def test_ttl(queue):
+    poller = QstatPoller(cmd=queue.cmd, ttl=0.5)
+    queue.set(job(1))
+    assert list(poller.jobs()) == ['1.c009']
+    queue.set(job(1) + job(2))
+    # Served from the cache within ttl
+    assert list(poller.jobs()) == ['1.c009']
+    assert queue.runs() == poller.polls == 1
+    time.sleep(0.6)
+    assert list(poller.jobs()) == ['1.c009', '2.c009']
+    assert queue.runs() == poller.polls == 2
+    # refresh() with max_age skips the command if the jobs were just polled
+    poller.refresh(max_age=60)
+    assert queue.runs() == 2
+
+
+def test_subscribe_gets_known_jobs_then_changes(queue):
+    poller = QstatPoller(cmd=queue.cmd, min_interval=0.01, max_interval=0.05)
+    queue.set(job(1))
+    poller.refresh()
+    diffs = []
+    poller.subscribe(diffs.append)
+    try:
+        assert list(diffs[0].added) == ['1.c009']
+        queue.set(job(1) + job(2))
+        poller.poke()
+        wait_for(lambda: len(diffs) > 1)
+        assert list(diffs[1].added) == ['2.c009']
+    finally:
+        poller.unsubscribe(diffs.append)
+    wait_for(lambda: poller.thread is None)
+
+
+def test_backoff(queue):
+    poller = QstatPoller(cmd=queue.cmd, min_interval=0.01, max_interval=0.08, backoff=2.0)
+    queue.set(job(1))
+
+    def on_change(diff):
+        pass
+
+    poller.subscribe(on_change)
+    try:
+        # The first poll finds the job, the next ones find nothing new: 0.02, 0.04 then 0.08 s apart
+        wait_for(lambda: poller.interval == poller.max_interval)
+        runs = queue.runs()
+        assert runs >= 4
+        time.sleep(0.4)
+        # Backed off, it polls at most once per max_interval
+        assert queue.runs() - runs <= 0.4 / poller.max_interval + 1
+        poller.poke()
+        assert poller.interval == poller.min_interval
+    finally:
+        poller.unsubscribe(on_change)
+    wait_for(lambda: poller.thread is None)